@@ -0,0 +1,120 @@
+'''
+batchScheduler.py
+
+Function: Merges model calls made at the same time by different threads into shared batches (used by translateServer.py, and by translateSubtitles.py / translateWord.py when several files are translated at the same time)
+	Each thread hands over its batch of strings and waits. A single worker thread collects the batches which are waiting for the same translation direction, and sends them to the model together once either 'maxItems' strings or 'maxTokens' tokens are waiting, or the oldest batch has waited 'maxWait' seconds
+	Each thread gets back the translations of its own strings, in the same order
+	Identical strings which are waiting at the same time (from different requests) are only translated once
+	Counts how many model calls were saved this way
+
+Requirements:
+	Python
+'''
+
+# MODULES =========================================
+
+import time
+import threading
+from types import SimpleNamespace
+
+from runStats import countTokens
+
+# DATA TYPES =======================================
+
+class BatchScheduler:
+	def __init__(self, translate, maxItems=64, maxTokens=0, maxWait=0.01):
+		# translate: function which translates a batch: translate(model, texts, sourceLang, targetLang) -> list of translated strings (ex: DecodeGuard().translate)
+		# maxItems: max amount of strings sent to the model in one call
+		# maxTokens: max amount of tokens (see runStats.countTokens) sent to the model in one call (0 = no limit). Keeps batches of long strings from using too much memory
+		# maxWait: max amount of time (in seconds) a batch waits for other batches to join it
+		self.translateFn = translate
+		self.maxItems = maxItems
+		self.maxTokens = maxTokens
+		self.maxWait = maxWait
+		self.pending = {} # (sourceLang, targetLang) -> list of requests waiting to be translated. Each request is a SimpleNamespace(model, texts, tokens, arrived, done, res, error)
+		self.cond = threading.Condition()
+		self.closed = False
+
+		self.requests = 0 # amount of batches handed over
+		self.calls = 0 # amount of model calls made
+		self.texts = 0 # amount of strings handed over
+		self.coalesced = 0 # amount of strings which werent sent to the model because an identical string was waiting at the same time
+		self.full = 0 # amount of calls made because the batch was full (the rest were made once the oldest batch had waited maxWait)
+
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+
+	# Translates a batch of strings, together with any other batches waiting for the same translation direction. Blocks until done, and returns the list of translated strings
+	def translate(self, model, texts, sourceLang, targetLang):
+		req = SimpleNamespace(model=model, texts=texts, tokens=sum([countTokens(v) for v in texts]), arrived=time.perf_counter(), done=threading.Event(), res=None, error=None)
+		with self.cond:
+			if self.closed: raise RuntimeError("BatchScheduler is closed")
+			self.pending.setdefault((sourceLang, targetLang), []).append(req)
+			self.requests += 1
+			self.texts += len(texts)
+			self.cond.notify()
+		req.done.wait()
+		if req.error is not None: raise req.error
+		return req.res
+
+	# Whether or not a batch of 'items' strings and 'tokens' tokens is full
+	def _isFull(self, items, tokens):
+		return (items >= self.maxItems) or ((self.maxTokens > 0) and (tokens >= self.maxTokens))
+
+	# Waits for the next group of requests to send to the model. Returns (direction, list of requests, whether or not the batch was full), or None once closed
+	def _next(self):
+		with self.cond:
+			while True:
+				if len(self.pending) == 0:
+					if self.closed: return None
+					self.cond.wait()
+					continue
+
+				# the direction whose oldest request has waited the longest goes first
+				direction = min(self.pending, key=lambda k: self.pending[k][0].arrived)
+				queue = self.pending[direction]
+				full = self._isFull(sum([len(v.texts) for v in queue]), sum([v.tokens for v in queue]))
+				remaining = queue[0].arrived + self.maxWait - time.perf_counter()
+				if (remaining > 0) and not full and not self.closed:
+					self.cond.wait(remaining)
+					continue
+
+				# take whole requests (oldest first), as long as they fit in the batch (at least one request is always taken)
+				taken, items, tokens = [], 0, 0
+				while (len(queue) > 0) and ((len(taken) == 0) or not self._isFull(items + len(queue[0].texts) - 1, tokens + queue[0].tokens - 1)):
+					items += len(queue[0].texts)
+					tokens += queue[0].tokens
+					taken.append(queue.pop(0))
+				if len(queue) == 0: del self.pending[direction]
+				return direction, taken, full
+
+	def _run(self):
+		while True:
+			group = self._next()
+			if group is None: return
+			(sourceLang, targetLang), taken, full = group
+
+			unique = list(dict.fromkeys([text for req in taken for text in req.texts]))
+			try:
+				res = dict(zip(unique, self.translateFn(taken[0].model, unique, sourceLang, targetLang)))
+				for req in taken: req.res = [res[v] for v in req.texts]
+			except Exception as e:
+				for req in taken: req.error = e
+
+			with self.cond:
+				self.calls += 1
+				if full: self.full += 1
+				self.coalesced += sum([len(req.texts) for req in taken]) - len(unique)
+			for req in taken: req.done.set()
+
+	# Finishes the requests which are already waiting, then stops the worker thread
+	def close(self):
+		with self.cond:
+			self.closed = True
+			self.cond.notify()
+		self.thread.join()
+
+	def report(self):
+		if self.requests == 0: return "Batch scheduler: no batches"
+		return ("Batch scheduler: " + str(self.requests) + " batch(es) of " + str(self.texts) + " string(s) sent to the model in " + str(self.calls) + " call(s)"
+			+ " (" + str(round(self.texts / max(self.calls, 1), 1)) + " string(s) per call, " + str(self.full) + " full), " + str(self.coalesced) + " identical string(s) translated once")
@@ -0,0 +1,244 @@
+'''
+benchmarkTranslate.py
+
+Function: Measures the throughput of the translation pipeline (translateSubtitles.py and translateWord.py) without real models
+	A stub translator (same interface as EasyNMT) stands in for the opus-mt models. It "translates" deterministically, and sleeps for a configurable time per call and per token to imitate the cost of a real model
+	Synthetic .srt and .docx files of several sizes are generated in a temporary folder
+	Results are written to a JSON file, so that runs can be compared to catch performance regressions
+
+Requirements:
+	Python
+	Install python-docx library: terminal > "pip install python-docx" (only for the Word cases)
+	translateSubtitles.py, translateWord.py and the modules they use (in the same folder as this python file)
+
+Usage:
+	python benchmarkTranslate.py
+'''
+
+# CONFIG ==========================================
+
+from types import SimpleNamespace
+cfg = SimpleNamespace(**{
+	"srtSizes": [100, 1000, 5000], # amount of subtitles in each synthetic .srt file
+	"docSizes": [50, 500], # amount of paragraphs in each synthetic .docx file (each also gets a table with a row for every 10 paragraphs)
+	"amtFiles": 4, # amount of files per size in the end-to-end cases
+	"repeats": 3, # each case is timed this many times, and the fastest time is kept
+
+	"callLatency": 0.002, # seconds the stub translator sleeps per call to translate()
+	"tokenLatency": 0.00005, # seconds the stub translator sleeps per (whitespace separated) input token
+
+	"cases": ["srtParse", "filter", "docTraversal", "srtEndToEnd", "docEndToEnd"], # remove cases to skip them
+	"docEngine": "xml", # translateWord.py engine used for the docEndToEnd case (docTraversal measures both)
+	"outFile": "benchmark.json", # machine-readable results
+})
+
+# MODULES ========================================
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+from contextlib import redirect_stdout
+
+# DATA TYPES =======================================
+
+class StubTranslator: # stands in for EasyNMT(translator=models.AutoModel(path))
+	def __init__(self, path, backend="torch"):
+		self.path = path
+		self.calls = 0
+		self.tokens = 0
+
+	def translate(self, documents, target_lang, source_lang=None, **kwargs):
+		texts = [documents] if isinstance(documents, str) else documents
+		tokens = sum([len(v.split()) for v in texts])
+		self.calls += 1
+		self.tokens += tokens
+		time.sleep(cfg.callLatency + cfg.tokenLatency * tokens)
+
+		res = [" ".join([(w[::-1] if any([c.isalpha() for c in w]) else w) for w in v.split()]) for v in texts] # deterministic "translation": every word reversed (numbers, symbols and placeholders are left as-is, like a real model would)
+		return res[0] if isinstance(documents, str) else res
+
+# FUNCTIONS =======================================
+
+WORDS = "the quick brown fox jumps over a lazy dog while seven tired engineers measure throughput on old hardware".split()
+
+# Returns a list of synthetic subtitle texts, including the cases which translateText_robust filters out (numbers, single letters, "1." prefixes..)
+def syntheticTexts(amt):
+	res = []
+	for i in range(amt):
+		if i % 17 == 0: res.append(str(i) + ".5")
+		elif i % 23 == 0: res.append("r")
+		elif i % 11 == 0: res.append("1. " + " ".join(WORDS[(i % 7):(i % 7) + 5]))
+		elif i % 29 == 0: res.append("Stop it!)....")
+		else: res.append(" ".join([WORDS[(i*3 + j) % len(WORDS)] for j in range(3 + i % 9)]).capitalize() + ".")
+	return res
+
+# Returns a .srt timestamp (HH:MM:SS,mmm) for an amount of milliseconds
+def timestamp(ms):
+	return "%02d:%02d:%02d,%03d" % (ms // 3600000, (ms // 60000) % 60, (ms // 1000) % 60, ms % 1000)
+
+def syntheticSrt(amt):
+	lines = []
+	for i, text in enumerate(syntheticTexts(amt)):
+		lines.append(str(i+1))
+		lines.append(timestamp(i * 3000) + " --> " + timestamp(i * 3000 + 2500))
+		if (i % 3 == 0) and (" " in text): # some subtitles span two lines
+			lines.append(text[:text.index(" ")])
+			lines.append(text[text.index(" ")+1:])
+		else: lines.append(text)
+		lines.append("")
+	return "\n".join(lines)
+
+def syntheticDocx(path, amt):
+	import docx
+	doc = docx.Document()
+	texts = syntheticTexts(amt)
+	for i, text in enumerate(texts):
+		p = doc.add_paragraph()
+		if i % 4 == 0: # some paragraphs are split into several differently formatted runs
+			words = text.split(" ")
+			p.add_run(" ".join(words[:len(words)//2]) + " ").bold = True
+			p.add_run(" ".join(words[len(words)//2:]))
+		else: p.add_run(text)
+
+	table = doc.add_table(rows=max(1, amt // 10), cols=3)
+	for r, row in enumerate(table.rows):
+		for c, cell in enumerate(row.cells): cell.text = texts[(r*3 + c) % len(texts)]
+	doc.save(path)
+
+# Times 'function' cfg.repeats times (with 'setup' called before each repeat), and returns the fastest time in seconds
+def timeIt(function, setup=None):
+	best = None
+	for r in range(cfg.repeats):
+		if setup is not None: setup()
+		with open(os.devnull, "w") as fnull, redirect_stdout(fnull): # the pipeline prints a lot
+			start = time.perf_counter()
+			function()
+			seconds = time.perf_counter() - start
+		if (best is None) or (seconds < best): best = seconds
+	return best
+
+def result(case, size, seconds, segments, files=None, **extra):
+	res = {"case": case, "size": size, "seconds": round(seconds, 6), "segments": segments, "segmentsPerSec": round(segments / seconds, 2) if seconds > 0 else None}
+	if files is not None:
+		res["files"] = files
+		res["filesPerSec"] = round(files / seconds, 3) if seconds > 0 else None
+	res.update(extra)
+	print(" " + case + ((" (" + extra["engine"] + ")") if "engine" in extra else "") + " [" + str(size) + "]: " + str(round(seconds, 4)) + "s, " + str(res["segmentsPerSec"]) + " segments/s" + ((", " + str(res["filesPerSec"]) + " files/s") if files is not None else ""))
+	return res
+
+# Points a script's cfg at the benchmark's folders, and swaps its models for stub translators
+def prepare(module, folder, modelsKey):
+	from modelRegistry import ModelOrganiser
+	for name in ["in", "inter", "out"]:
+		shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+		os.makedirs(os.path.join(folder, name))
+	module.cfg.inPath = os.path.join(folder, "in") + os.sep
+	module.cfg.interPath = os.path.join(folder, "inter") + os.sep
+	module.cfg.outPath = os.path.join(folder, "out") + os.sep
+	module.cfg.verbosity = 0
+	module.cfg.testingMode = False
+	module.cfg.resume = False
+	module.cfg.translationMemory = False # every run must actually translate
+	return ModelOrganiser(getattr(module.cfg, modelsKey), loader=StubTranslator)
+
+# CASES ============================================
+
+def bench_srt(folder):
+	import translateSubtitles as ts
+	res = []
+	ts.Translate.translateModels = prepare(ts, folder, "translateModels")
+	ts.Translate.translationMemory = None
+
+	for size in cfg.srtSizes:
+		text = syntheticSrt(size)
+
+		if "srtParse" in cfg.cases:
+			seconds = timeIt(lambda: sum([1 for v in ts._readSubtitles(io.StringIO(text))]))
+			res.append(result("srtParse", size, seconds, size))
+
+		if "filter" in cfg.cases:
+			texts = syntheticTexts(size)
+			seconds = timeIt(lambda: [ts.Translate.planText(v) for v in texts])
+			res.append(result("filter", size, seconds, size))
+
+		if "srtEndToEnd" in cfg.cases:
+			names = ["bench" + str(size) + "-" + str(i) + ".srt" for i in range(cfg.amtFiles)]
+			for name in names:
+				with io.open(ts.cfg.inPath + name, mode="w", encoding="utf-8") as f: f.write(text)
+			model = ts.Translate.translateModels.get(ts.cfg.inLang, ts.cfg.outLang[0])
+			calls = model.calls
+			seconds = timeIt(lambda: [ts._translateSubtitles(name) for name in names])
+			res.append(result("srtEndToEnd", size, seconds, size * len(names), files=len(names), modelCalls=(model.calls - calls) // cfg.repeats))
+
+	return res
+
+def bench_docx(folder):
+	import translateWord as tw
+	import wordXml
+	res = []
+	tw.Translate.translateModels = prepare(tw, folder, "translationModels")
+	tw.Translate.translationMemory = None
+	tw.cfg.convertToPDF = False
+	tw.cfg.workers = 1
+	tw.cfg.docEngine = cfg.docEngine
+
+	for size in cfg.docSizes:
+		names = ["bench" + str(size) + "-" + str(i) + ".docx" for i in range(cfg.amtFiles)]
+		for name in names: syntheticDocx(tw.cfg.inPath + name, size)
+
+		if "docTraversal" in cfg.cases:
+			for engine, collect in [("python-docx", tw.Translate.collectSegments), ("xml", wordXml.collectSegments)]:
+				tw.cfg.docEngine = engine
+				loaded = tw.Translate.loadDoc(names[0])
+				segments = len(loaded.segments)
+				seconds = timeIt(lambda: collect(loaded.doc))
+				res.append(result("docTraversal", size, seconds, segments, engine=engine))
+				seconds = timeIt(lambda: tw.Translate.loadDoc(names[0]))
+				res.append(result("docLoad", size, seconds, segments, engine=engine))
+			tw.cfg.docEngine = cfg.docEngine
+
+		if "docEndToEnd" in cfg.cases:
+			def clear():
+				for name in os.listdir(tw.cfg.outPath): os.remove(tw.cfg.outPath + name)
+			tw.update_fileList()
+			tw.files.inPath_docx = names # only this size
+			segments = len(tw.Translate.loadDoc(names[0]).segments) # every document of this size has the same segments
+			model = tw.Translate.translateModels.get(tw.cfg.inLanguage, tw.cfg.outLanguage[0])
+			calls = model.calls
+			seconds = timeIt(tw.translateAll, setup=clear)
+			res.append(result("docEndToEnd", size, seconds, segments * len(names) * len(tw.cfg.outLanguage), files=len(names) * len(tw.cfg.outLanguage), modelCalls=(model.calls - calls) // cfg.repeats, engine=cfg.docEngine))
+
+	return res
+
+# MAIN =============================================
+
+if __name__ == "__main__":
+	print("Config options:", str(vars(cfg)))
+	folder = tempfile.mkdtemp(prefix="benchmarkTranslate-")
+	results = []
+
+	try:
+		print("Subtitles:")
+		results += bench_srt(os.path.join(folder, "srt"))
+
+		if any([v in cfg.cases for v in ["docTraversal", "docEndToEnd"]]):
+			print("Word:")
+			try: results += bench_docx(os.path.join(folder, "docx"))
+			except ImportError as e: print("Skipping Word cases: " + str(e))
+	finally:
+		shutil.rmtree(folder, ignore_errors=True)
+
+	with open(cfg.outFile, mode="w", encoding="utf-8") as f:
+		json.dump({
+			"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"python": sys.version.split()[0],
+			"platform": platform.platform(),
+			"config": vars(cfg),
+			"results": results,
+		}, f, indent=2)
+	print("Results written to " + cfg.outFile)
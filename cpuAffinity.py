@@ -0,0 +1,106 @@
+'''
+cpuAffinity.py
+
+Function: CPU thread and core placement for translation models (used by translateSubtitles.py, translateWord.py and translateServer.py)
+	Sets how many threads a model uses to translate one batch (intra-op), and how many batches can run side by side (inter-op)
+	Can pin a translator (a process) to its own set of cores, so that several translators running at once dont fight over the same cores
+	Cores are split between translators one NUMA node at a time, so that a translator's cores (and the memory they use) stay on the same node
+	Thread settings are applied when the first model is loaded (see inferenceBackend.py), so that torch isnt imported before its needed
+
+Requirements:
+	Python
+	Pinning cores only works on Linux (elsewhere, only the thread counts are set)
+'''
+
+# MODULES =========================================
+
+import os
+import sys
+import glob
+from types import SimpleNamespace
+
+# DATA ============================================
+
+settings = SimpleNamespace(**{
+	"intraOp": 0, # threads per batch (0 = let the backend decide)
+	"interOp": 0, # batches run side by side (0 = let the backend decide)
+	"cpus": None, # list of cores this process is pinned to (None = not pinned)
+	"applied": False, # whether or not torch's thread settings were applied
+})
+
+# FUNCTIONS =======================================
+
+# Returns the list of cores in a Linux cpu list (ex: "0-3,8,10-11")
+def parseCpuList(text):
+	cpus = []
+	for part in text.strip().split(","):
+		if part == "": continue
+		if "-" in part:
+			first, last = part.split("-")
+			cpus += list(range(int(first), int(last) + 1))
+		else: cpus.append(int(part))
+	return cpus
+
+# Returns the list of cores this process is allowed to run on
+def availableCpus():
+	if hasattr(os, "sched_getaffinity"): return sorted(os.sched_getaffinity(0))
+	return list(range(os.cpu_count() or 1))
+
+# Returns a list of the available cores on each NUMA node (a single node with every available core, if the system doesnt report its nodes)
+def numaNodes():
+	available = set(availableCpus())
+	nodes = []
+	for path in sorted(glob.glob("/sys/devices/system/node/node*/cpulist"), key=lambda v: int(v.split("node")[-1].split("/")[0])):
+		with open(path) as f: cpus = [v for v in parseCpuList(f.read()) if v in available]
+		if len(cpus) > 0: nodes.append(cpus)
+	return nodes if len(nodes) > 0 else [sorted(available)]
+
+# Splits the available cores between translators. Returns a list of cores for each of this instance's 'amt' translators
+# threadsPer: cores per translator (0 = share all the cores equally)
+# numaAware: never give a translator cores from more than one NUMA node
+# instance, instances: when several copies of a script run side by side, each one uses its own share of the cores (instance is 0 for the first copy)
+def planCores(amt, threadsPer=0, numaAware=True, instance=0, instances=1):
+	nodes = numaNodes() if numaAware else [availableCpus()]
+	total = amt * instances
+	per = threadsPer if threadsPer > 0 else max(1, sum([len(v) for v in nodes]) // total)
+
+	blocks = [node[b:b+per] for node in nodes for b in range(0, len(node) - per + 1, per)]
+	if len(blocks) == 0: # more cores per translator than any node has
+		cpus = [v for node in nodes for v in node]
+		blocks = [cpus[b:b+per] for b in range(0, len(cpus), per)]
+	if len(blocks) < total: print("Warning: " + str(total) + " translator(s) with " + str(per) + " core(s) each dont fit on " + str(sum([len(v) for v in nodes])) + " core(s); some cores are shared")
+	return [blocks[(instance * amt + k) % len(blocks)] for k in range(amt)]
+
+# Sets this process' thread counts, and pins it to 'cpus' (optional)
+# the thread counts are passed on to OpenMP / MKL right away, and to torch once its imported (see applyTorchThreads)
+def applyThreads(intraOp=0, interOp=0, cpus=None):
+	if (intraOp <= 0) and (cpus is not None): intraOp = len(cpus) # one thread per pinned core
+	settings.intraOp, settings.interOp, settings.cpus, settings.applied = intraOp, interOp, cpus, False
+
+	if cpus is not None:
+		if hasattr(os, "sched_setaffinity"): os.sched_setaffinity(0, cpus)
+		else: print("Pinning cores isnt supported on this system; only the thread counts are set")
+	if intraOp > 0:
+		for name in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]: os.environ[name] = str(intraOp)
+	if "torch" in sys.modules: applyTorchThreads()
+
+# Applies the thread counts to torch. Called when a model is loaded (torch is imported by then), and only does anything the first time
+def applyTorchThreads():
+	if settings.applied: return
+	settings.applied = True
+	try: import torch
+	except ImportError: return # backends which dont use torch
+	if settings.intraOp > 0: torch.set_num_threads(settings.intraOp)
+	if settings.interOp > 0:
+		try: torch.set_num_interop_threads(settings.interOp)
+		except RuntimeError: print("Couldnt set torch's inter-op threads (torch already started running)")
+
+# Returns (instance, instances) from a command line option in the form "i/n" (ex: "0/4" is the first of 4 copies)
+def parseInstance(text):
+	instance, instances = [int(v) for v in text.split("/")]
+	if not (0 <= instance < instances): raise ValueError("instance must be in the form i/n, with 0 <= i < n (got " + text + ")")
+	return instance, instances
+
+def report():
+	return ("CPU threads: " + (str(settings.intraOp) if settings.intraOp > 0 else "default") + " per batch, " + (str(settings.interOp) if settings.interOp > 0 else "default") + " inter-op"
+		+ (", pinned to core(s) " + ",".join([str(v) for v in settings.cpus]) if settings.cpus is not None else ""))
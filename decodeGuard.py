@@ -0,0 +1,125 @@
+'''
+decodeGuard.py
+
+Function: Keeps the translation model from wasting time on runaway output (used by translateSubtitles.py and translateWord.py)
+	The max amount of tokens the model may generate is derived from the length of the input, instead of always allowing 512
+		any translation more than 'maxOutputRatio' times longer (in characters) than its input is thrown away as garbage anyway, and every token is at least one character long, so this never cuts off a translation which would have been kept
+	While decoding, generation is stopped as soon as every sequence in the batch is either finished, or stuck repeating the same few tokens over and over
+	Counts how many decode steps were saved
+
+Requirements:
+	Python
+	The transformers library (installed along with easynmt) for stopping generation early. Without it, only the length limits are applied
+'''
+
+# MODULES =========================================
+
+import threading
+
+# DATA ============================================
+
+WINDOW = 16 # amount of generated tokens checked for repetition
+MAX_PERIOD = 4 # max length (in tokens) of a repeating pattern
+stoppingCriteria = None # class RepetitionStop, created when first needed (see _stoppingCriteria)
+
+# FUNCTIONS =======================================
+
+# Returns how many times the end of 'items' (a string or list) repeats a pattern of at most 'maxPeriod' items
+def tailRepeats(items, maxPeriod):
+	best = 1
+	for period in range(1, maxPeriod + 1):
+		if len(items) < 2 * period: break
+		unit = items[-period:]
+		k = 1
+		while (len(items) >= (k+1) * period) and (items[len(items) - (k+1)*period:len(items) - k*period] == unit): k += 1
+		best = max(best, k)
+	return best
+
+# Whether or not a translation ends with text repeating itself, when its source text doesnt (ex: "je ne sais pas pas pas pas pas")
+# this catches translations which were stopped early by the guard, as well as ones which hit the token limit
+def isRepetitive(text, source):
+	punctuation = " .,!?…"
+	words, sourceWords = [v.strip(punctuation) for v in text.split()], [v.strip(punctuation) for v in source.split()]
+	if (tailRepeats(words, MAX_PERIOD) >= 4) and (tailRepeats(sourceWords, MAX_PERIOD) < 4): return True
+	if (tailRepeats(text.rstrip(punctuation), 6) >= 8) and (tailRepeats(source.rstrip(punctuation), 6) < 8): return True # for languages written without spaces
+	return False
+
+# Whether or not the last WINDOW tokens are a pattern of at most MAX_PERIOD tokens, repeated
+def _stuck(tail):
+	return any([tail == (tail[-period:] * (WINDOW // period + 1))[-WINDOW:] for period in range(1, MAX_PERIOD + 1)])
+
+# Returns the RepetitionStop class (a transformers StoppingCriteria), or None if transformers isnt installed
+def _stoppingCriteria():
+	global stoppingCriteria
+	if stoppingCriteria is not None: return stoppingCriteria
+	try:
+		import torch
+		import transformers
+		from transformers import StoppingCriteria
+	except ImportError: return None
+	perRow = tuple([int(v) for v in transformers.__version__.split(".")[:2]]) >= (4, 39) # newer versions stop each sequence separately; older ones expect a single bool for the whole batch
+
+	class RepetitionStop(StoppingCriteria):
+		def __init__(self, finishedIds):
+			self.finishedIds = finishedIds # token ids which only appear once a sequence is finished (end of sequence, padding)
+			self.stuck = False # whether or not any sequence got stuck
+			self.stoppedAt = None # decode step at which generation was stopped by this guard
+
+		def __call__(self, input_ids, scores, **kwargs):
+			rows = input_ids.shape[0]
+			step = input_ids.shape[-1]
+			if step < WINDOW: stop = [False] * rows
+			else:
+				stop = []
+				for tail in input_ids[:, -WINDOW:].tolist(): # only the end of each sequence is copied, so each check costs the same no matter how long the output gets
+					if tail[-1] in self.finishedIds: stop.append(True)
+					elif _stuck(tail):
+						self.stuck = True
+						stop.append(True)
+					else: stop.append(False)
+				if self.stuck and all(stop): self.stoppedAt = step
+			if perRow: return torch.tensor(stop, dtype=torch.bool, device=input_ids.device)
+			return all(stop)
+
+	stoppingCriteria = RepetitionStop
+	return stoppingCriteria
+
+# DATA TYPES =======================================
+
+class DecodeGuard:
+	def __init__(self, maxNewTokens=512, maxOutputRatio=3, stopEarly=True):
+		self.maxNewTokens = maxNewTokens
+		self.maxOutputRatio = maxOutputRatio
+		self.stopEarly = stopEarly
+		self.calls = 0
+		self.limited = 0 # sum of how much lower than maxNewTokens each call's limit was
+		self.stops = 0 # amount of calls stopped early because of repetition
+		self.saved = 0 # decode steps saved by stopping early (for every sequence in the batch)
+		self.lock = threading.Lock()
+
+	# Translates 'texts' with 'model' (EasyNMT), with a max amount of new tokens derived from the longest text, and (with 'stopEarly') a repetition guard
+	def translate(self, model, texts, sourceLang, targetLang):
+		limit = min(self.maxNewTokens, int(self.maxOutputRatio * max([len(v) for v in texts])) + 8)
+		options = {"max_new_tokens": limit}
+
+		guard = None
+		if self.stopEarly and (_stoppingCriteria() is not None):
+			from transformers import StoppingCriteriaList
+			tokenizer = getattr(getattr(model, "translator", None), "tokenizer", None)
+			guard = _stoppingCriteria()(set([v for v in [getattr(tokenizer, "eos_token_id", None), getattr(tokenizer, "pad_token_id", None)] if v is not None]))
+			options["stopping_criteria"] = StoppingCriteriaList([guard])
+
+		res = model.translate(texts, source_lang=sourceLang, target_lang=targetLang, batch_size=len(texts), **options)
+
+		with self.lock:
+			self.calls += 1
+			self.limited += self.maxNewTokens - limit
+			if (guard is not None) and (guard.stoppedAt is not None):
+				self.stops += 1
+				self.saved += (limit - guard.stoppedAt) * len(texts)
+		return res
+
+	def report(self):
+		if self.calls == 0: return "Decoding guard: no model calls"
+		return ("Decoding guard: max_new_tokens lowered from " + str(self.maxNewTokens) + " to " + str(round(self.maxNewTokens - self.limited / self.calls, 1)) + " on average, "
+			+ str(self.stops) + " batch(es) stopped early because of repetition (" + str(self.saved) + " decode step(s) saved)")
@@ -0,0 +1,162 @@
+'''
+inferenceBackend.py
+
+Function: Loads translation models with the inference backend chosen for them (used by modelRegistry.py)
+	"torch": the full precision opus-mt model, through EasyNMT (default)
+	"int8": the same model, with its linear layers quantized to 8 bit integers when it is loaded (torch dynamic quantization). Runs on the CPU, usually around 2x faster
+	"ctranslate2": the model converted to CTranslate2, with int8 weights. Runs on the CPU, usually 3-4x faster
+	"onnx": the model exported to ONNX Runtime
+	Converting a model to "ctranslate2" or "onnx" takes a while, so it is only done once: the converted model is cached in a folder next to the original one (ex: "opus-mt-en-fr-ctranslate2\\")
+	Every backend returns an object with the same translate() method as EasyNMT, so the rest of the pipeline doesnt need to know which one is used
+	Every backend uses the thread counts set with cpuAffinity.py
+	Like EasyNMT, the "ctranslate2" and "onnx" backends split texts into lines and sentences before translating them (opus-mt models are trained on single sentences), and split sentences which are too long for the model into parts
+
+Requirements:
+	"torch" and "int8": Install the easynmt module: terminal > "pip install easynmt"
+	"ctranslate2": terminal > "pip install ctranslate2" (and transformers, which is installed along with easynmt)
+	"onnx": terminal > "pip install optimum[onnxruntime]"
+'''
+
+# MODULES =========================================
+
+import os
+import re
+import shutil
+from types import SimpleNamespace
+
+import cpuAffinity # thread counts
+
+# FUNCTIONS =======================================
+
+# Returns the folder in which the 'backend' version of the model in 'path' is cached (ex: "opus-mt-en-fr\\" -> "opus-mt-en-fr-ctranslate2\\")
+def cachePath(path, backend):
+	base = path.rstrip("\\/")
+	return base + "-" + backend + path[len(base):]
+
+# Converts a model with 'convert' (a function which writes the converted model to a folder), unless it was already converted by a previous run. Returns the cached folder
+# the conversion is written to a temporary folder first, so that an interrupted conversion isnt mistaken for a finished one
+# the temporary folder is named after the process, since worker processes may convert the same model at the same time: the first one to finish is used, and the others are discarded
+def cached(path, backend, convert):
+	cache = cachePath(path, backend)
+	if os.path.isdir(cache): return cache
+
+	print("Converting model " + path + " to " + backend + " (only done once)..")
+	tmp = cache.rstrip("\\/") + ".tmp" + str(os.getpid())
+	shutil.rmtree(tmp, ignore_errors=True)
+	try:
+		convert(tmp)
+		os.replace(tmp, cache.rstrip("\\/"))
+	except OSError:
+		shutil.rmtree(tmp, ignore_errors=True)
+		if not os.path.isdir(cache): raise
+		print("Model " + path + " was converted to " + backend + " by another process, using that one")
+	return cache
+
+def load_torch(path, device=None):
+	from easynmt import EasyNMT, models # NMT translator (imported here, since importing it takes a while)
+	cpuAffinity.applyTorchThreads()
+	return EasyNMT(translator=models.AutoModel(path), device=device)
+
+def load_int8(path):
+	import torch
+	model = load_torch(path, device="cpu") # quantized models only run on the CPU
+	model.translator.model = torch.quantization.quantize_dynamic(model.translator.model.float().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+	return model
+
+def load_ctranslate2(path):
+	import ctranslate2
+	from transformers import AutoTokenizer
+
+	cache = cached(path, "ctranslate2", lambda folder: ctranslate2.converters.TransformersConverter(path).convert(folder, quantization="int8"))
+	translator = ctranslate2.Translator(cache, device="cpu", compute_type="int8", intra_threads=cpuAffinity.settings.intraOp, inter_threads=max(1, cpuAffinity.settings.interOp))
+	tokenizer = AutoTokenizer.from_pretrained(path)
+
+	def generate(texts, beamSize, maxNewTokens, stoppingCriteria):
+		# CTranslate2 cant use transformers' stopping criteria; only the length limit is applied
+		tokens = [tokenizer.convert_ids_to_tokens(tokenizer.encode(v)) for v in texts]
+		results = translator.translate_batch(tokens, max_batch_size=len(texts), beam_size=beamSize, max_decoding_length=maxNewTokens)
+		return [tokenizer.decode(tokenizer.convert_tokens_to_ids(v.hypotheses[0]), skip_special_tokens=True) for v in results]
+
+	return Seq2SeqTranslator(generate, tokenizer)
+
+def load_onnx(path):
+	import onnxruntime
+	from optimum.onnxruntime import ORTModelForSeq2SeqLM
+	from transformers import AutoTokenizer
+	cpuAffinity.applyTorchThreads() # generate() runs partly in torch
+
+	def convert(folder):
+		ORTModelForSeq2SeqLM.from_pretrained(path, export=True).save_pretrained(folder)
+		AutoTokenizer.from_pretrained(path).save_pretrained(folder)
+	cache = cached(path, "onnx", convert)
+	options = onnxruntime.SessionOptions()
+	if cpuAffinity.settings.intraOp > 0: options.intra_op_num_threads = cpuAffinity.settings.intraOp
+	if cpuAffinity.settings.interOp > 0: options.inter_op_num_threads = cpuAffinity.settings.interOp
+	model = ORTModelForSeq2SeqLM.from_pretrained(cache, session_options=options)
+	tokenizer = AutoTokenizer.from_pretrained(cache)
+
+	def generate(texts, beamSize, maxNewTokens, stoppingCriteria):
+		inputs = tokenizer(texts, return_tensors="pt", padding=True) # inputs are never truncated: Seq2SeqTranslator splits texts which are too long
+		options = {"num_beams": beamSize, "max_new_tokens": maxNewTokens}
+		if stoppingCriteria is not None: options["stopping_criteria"] = stoppingCriteria
+		return tokenizer.batch_decode(model.generate(**inputs, **options), skip_special_tokens=True)
+
+	return Seq2SeqTranslator(generate, tokenizer)
+
+BACKENDS = {
+	"torch": load_torch,
+	"int8": load_int8,
+	"ctranslate2": load_ctranslate2,
+	"onnx": load_onnx,
+}
+
+# Loads the model in the folder 'path' with one of the BACKENDS
+def loadModel(path, backend="torch"):
+	if backend not in BACKENDS: raise ValueError("Unknown inference backend: " + str(backend) + " (expected one of: " + ", ".join(BACKENDS.keys()) + ")")
+	return BACKENDS[backend](path)
+
+# DATA TYPES =======================================
+
+class Seq2SeqTranslator: # stands in for EasyNMT, for the backends which dont run through it
+	def __init__(self, generate, tokenizer, maxInputTokens=512):
+		self.generate = generate # function(texts, beamSize, maxNewTokens, stoppingCriteria) -> list of translated strings
+		self.translator = SimpleNamespace(tokenizer=tokenizer) # same place as EasyNMT's tokenizer (see decodeGuard.py)
+		self.maxInputTokens = min(maxInputTokens, getattr(tokenizer, "model_max_length", maxInputTokens)) - 1 # the end of sequence token is added to every input
+
+	# Splits a line of text into sentences
+	def splitSentences(self, line):
+		return [v for v in re.split(r"(?<=[.!?…。！？])\s+", line) if v.strip() != ""]
+
+	# Splits a sentence into parts of at most maxInputTokens tokens (between words), so that the model sees all of it
+	def splitLong(self, sentence):
+		tokenize = self.translator.tokenizer.tokenize
+		if len(tokenize(sentence)) <= self.maxInputTokens: return [sentence]
+		parts, words, amt = [], [], 0
+		for word in sentence.split(" "):
+			size = len(tokenize(word))
+			if (len(words) > 0) and (amt + size > self.maxInputTokens):
+				parts.append(" ".join(words))
+				words, amt = [], 0
+			words.append(word)
+			amt += size
+		return parts + [" ".join(words)]
+
+	# each text is split into lines, and each line into sentences (with 'perform_sentence_splitting'). The sentences of every text are translated in batches of 'batch_size', and put back together
+	def translate(self, documents, target_lang, source_lang=None, batch_size=16, beam_size=5, max_new_tokens=512, stopping_criteria=None, perform_sentence_splitting=True, **kwargs):
+		texts = [documents] if isinstance(documents, str) else documents
+
+		pieces, owners = [], [] # sentences (or parts of sentences) sent to the model, and the (text, line) each one belongs to
+		lines = [[[] for line in text.split("\n")] for text in texts] # translated pieces of every line of every text
+		for i, text in enumerate(texts):
+			for j, line in enumerate(text.split("\n")):
+				for sentence in (self.splitSentences(line) if perform_sentence_splitting else ([line] if line.strip() != "" else [])):
+					for part in self.splitLong(sentence):
+						pieces.append(part)
+						owners.append((i, j))
+
+		for b in range(0, len(pieces), batch_size):
+			for (i, j), translated in zip(owners[b:b+batch_size], self.generate(pieces[b:b+batch_size], beam_size, max_new_tokens, stopping_criteria)):
+				lines[i][j].append(translated)
+
+		res = ["\n".join([" ".join(v) for v in text]) for text in lines]
+		return res[0] if isinstance(documents, str) else res
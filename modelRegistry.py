@@ -0,0 +1,177 @@
+'''
+modelRegistry.py
+
+Function: Translation model registry shared by translateSubtitles.py and translateWord.py
+	Models are only loaded the first time they are needed
+	When a memory budget is set, the least recently used models are unloaded to make room for new ones, so that a long multi-language batch runs in a fixed amount of RAM
+		models which are in use (see ModelOrganiser.use) are never unloaded, since unloading them wouldnt free their memory, and they would need to be loaded again right away
+	The time taken to load each model is recorded, and can be reported at the end of a run
+	Models can be prefetched (loaded in a background thread) while another model is busy translating
+	Each model can be run with a different inference backend (full precision, int8, CTranslate2, ONNX Runtime; see inferenceBackend.py)
+	Language pairs without a direct model can be translated through a pivot language (ex: de->en->fr), when models for both hops are configured
+
+Requirements:
+	Install the easynmt module: terminal > "pip install easynmt" (this might be difficult to get working)
+	inferenceBackend.py (in the same folder as this python file)
+'''
+
+# MODULES =========================================
+
+import os
+import gc
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from runStats import stats # per-stage timing
+from inferenceBackend import loadModel, BACKENDS # loads a model with the backend chosen for it
+
+# FUNCTIONS =======================================
+
+# Returns the size (in bytes) of all the files in a folder. Used as an estimate of how much memory a model takes up once loaded
+def folderSize(path):
+	if os.path.isfile(path): return os.path.getsize(path)
+	size = 0
+	for root, dirs, filenames in os.walk(path):
+		for f in filenames: size += os.path.getsize(os.path.join(root, f))
+	return size
+
+# DATA TYPES =======================================
+
+class ModelOrganiser: # data type containing translation models, and their input and output languages
+	def __init__(self, translationModels, memoryBudget=0, loader=loadModel, pivotLanguage="en"):
+		# translationModels: dictionary, whose keys are folders containing pre-trained models, and whose values are their translation direction, as either:
+			# a list: [sourceLang, targetLang] or [sourceLang, targetLang, backend] (translateSubtitles.py's cfg.translateModels)
+			# a dictionary: {"sourceLang": sourceLang, "targetLang": targetLang} or {"sourceLang": sourceLang, "targetLang": targetLang, "backend": backend} (translateWord.py's cfg.translationModels)
+			# backend is the inference backend the model is run with (see inferenceBackend.BACKENDS). Default: "torch"
+		# memoryBudget: max amount of memory (in MB) for loaded models (0 = no limit). Model sizes are estimated from the size of their folder
+		# loader: function which loads a model, given its folder and backend (benchmarkTranslate.py replaces it with a stub model)
+		# pivotLanguage: language to translate through, for language pairs without a direct model ("" or None = only use direct models)
+		self.paths = {} # "sourceLang-targetLang" -> folder of the model
+		self.backends = {} # folder of a model -> its inference backend
+		for path, direction in translationModels.items():
+			if isinstance(direction, dict): direction = [direction["sourceLang"], direction["targetLang"], direction.get("backend", "torch")]
+			backend = direction[2] if len(direction) > 2 else "torch"
+			if backend not in BACKENDS: raise ValueError("Unknown inference backend for " + path + ": " + str(backend) + " (expected one of: " + ", ".join(BACKENDS.keys()) + ")")
+			self.paths.setdefault(direction[0] + "-" + direction[1], path)
+			self.backends.setdefault(path, backend)
+
+		self.pivotLanguage = pivotLanguage
+		self.memoryBudget = memoryBudget * 1024 * 1024
+		self.loader = loader
+		self.repo = OrderedDict() # folder -> SimpleNamespace(model, size, users). Ordered from least to most recently used. 'users' is the amount of callers currently using the model (see use)
+		self.loads = [] # list of (folder, seconds taken to load)
+		self.unloads = 0
+
+		self.lock = threading.Lock() # guards self.repo (a prefetch may be loading a model in the background)
+		self.loadLock = threading.Lock() # only one model is loaded at a time
+		self.prefetcher = None # ThreadPoolExecutor, created on the first prefetch
+
+	# Whether or not a language pair can be translated (directly, or through the pivot language)
+	def has(self, sourceLang, targetLang):
+		return self.hasDirect(sourceLang, targetLang) or (self.pivot(sourceLang, targetLang) is not None)
+
+	def hasDirect(self, sourceLang, targetLang):
+		return (sourceLang + "-" + targetLang) in self.paths
+
+	# Returns the language to translate through for a language pair without a direct model, or None (if there is a direct model, or no way through the pivot language)
+	def pivot(self, sourceLang, targetLang):
+		p = self.pivotLanguage
+		if self.hasDirect(sourceLang, targetLang) or (p in [None, "", sourceLang, targetLang]): return None
+		if self.hasDirect(sourceLang, p) and self.hasDirect(p, targetLang): return p
+		return None
+
+	# Returns the folder of the model with the desired translation direction (without loading it). Only for direct models
+	def path(self, sourceLang, targetLang):
+		if not self.hasDirect(sourceLang, targetLang): raise LookupError("No model with translation direction: " + sourceLang + "->" + targetLang + " configured.")
+		return self.paths[sourceLang + "-" + targetLang]
+
+	# Returns the name the model's translations are stored under in the translation memory: its folder and its backend (ex: "opus-mt-en-fr\\ (int8)"), since each backend translates a little differently
+	def memoryKey(self, sourceLang, targetLang):
+		path = self.path(sourceLang, targetLang)
+		return path + " (" + self.backends[path] + ")"
+
+	# Returns the model with the desired translation direction, loading it if needed
+	# the model may be unloaded by a later call (to stay within the memory budget) while it is still being used: to translate with it, see use
+	def get(self, sourceLang, targetLang):
+		return self._entry(sourceLang, targetLang).model
+
+	# Same as get, but as a context manager (ex: "with models.use("en", "fr") as model: ..."). The model isnt unloaded until the block ends
+	@contextmanager
+	def use(self, sourceLang, targetLang):
+		entry = self._entry(sourceLang, targetLang, hold=True)
+		try: yield entry.model
+		finally:
+			with self.lock: entry.users -= 1
+
+	# Returns the repo entry of the model with the desired translation direction, loading it if needed
+	# optional parameter 'hold' is whether or not to add a user to the entry (in the same locked step, so that it cant be unloaded in between)
+	def _entry(self, sourceLang, targetLang, hold=False):
+		path = self.path(sourceLang, targetLang)
+
+		with self.lock:
+			if path in self.repo:
+				self.repo.move_to_end(path)
+				self.repo[path].users += int(hold)
+				return self.repo[path]
+
+		with self.loadLock: # if this model is being prefetched, this waits for it to finish loading
+			with self.lock:
+				if path in self.repo: # loaded while waiting
+					self.repo.move_to_end(path)
+					self.repo[path].users += int(hold)
+					return self.repo[path]
+
+				# model has not been loaded yet (or was unloaded)
+				size = folderSize(path)
+				self.makeRoom(size)
+
+			start = time.perf_counter()
+			with stats.time("modelLoad", 1): model = self.loader(path, self.backends[path])
+			with self.lock:
+				self.loads.append((path, time.perf_counter() - start))
+				entry = self.repo[path] = SimpleNamespace(model=model, size=size, users=int(hold))
+			print("Loaded model with translation direction: " + sourceLang + "->" + targetLang + " from: " + path + " (" + self.backends[path] + ", " + str(round(self.loads[-1][1], 1)) + "s, ~" + str(size // (1024*1024)) + " MB)")
+			return entry
+
+	# Starts loading a model in a background thread, so that its ready by the time its needed
+	# nothing is done if the model is already loaded, or if loading it would unload the most recently used model (which is probably still busy translating)
+	def prefetch(self, sourceLang, targetLang):
+		p = self.pivot(sourceLang, targetLang)
+		if p is not None: # the first hop is needed first
+			self.prefetch(sourceLang, p)
+			self.prefetch(p, targetLang)
+			return
+		if not self.hasDirect(sourceLang, targetLang): return
+		path = self.path(sourceLang, targetLang)
+
+		with self.lock:
+			if path in self.repo: return
+			if (self.memoryBudget > 0) and (len(self.repo) > 0):
+				if folderSize(path) + self.repo[next(reversed(self.repo))].size > self.memoryBudget: return
+
+		if self.prefetcher is None: self.prefetcher = ThreadPoolExecutor(max_workers=1)
+		self.prefetcher.submit(self.get, sourceLang, targetLang) # if this fails, the error is raised again when the model is actually needed
+
+	# Unloads the least recently used models until a model of 'size' bytes fits within the memory budget
+	# models which are in use are skipped (if only those are left, the budget is exceeded until they are done)
+	def makeRoom(self, size):
+		if self.memoryBudget <= 0: return
+		unloaded = False
+		for path in list(self.repo.keys()): # from least to most recently used
+			if sum([v.size for v in self.repo.values()]) + size <= self.memoryBudget: break
+			if self.repo[path].users > 0: continue
+			del self.repo[path]
+			self.unloads += 1
+			unloaded = True
+			print("Unloaded model: " + path + " (memory budget of " + str(self.memoryBudget // (1024*1024)) + " MB reached)")
+		if unloaded: gc.collect() # free the unloaded models' memory before loading the next one
+
+	# Returns a summary of the models loaded during this run
+	def report(self):
+		lines = ["Models: " + str(len(self.loads)) + " load(s) taking " + str(round(sum([v[1] for v in self.loads]), 1)) + "s, " + str(self.unloads) + " unload(s)"]
+		for path, seconds in self.loads: lines.append("- " + path + " (" + self.backends[path] + "): " + str(round(seconds, 1)) + "s")
+		return "\n".join(lines)
@@ -0,0 +1,91 @@
+'''
+pdfConverter.py
+
+Function: Converts Word documents to PDF in the background (used by translateWord.py, with cfg.convertToPDF)
+	Conversions run in their own threads, so that the next document is translated while the previous one is being converted
+	Backends:
+		"docx2pdf": Microsoft Word, through the docx2pdf module (Windows / macOS). Word only converts one document at a time, so this backend always uses a single worker
+		"libreoffice": headless LibreOffice ("soffice --convert-to pdf"). Each worker keeps its own LibreOffice profile for the whole run, so that several conversions can run at once, and only the first conversion of each worker pays for setting up a profile
+
+Requirements:
+	Python
+	For the "docx2pdf" backend: Install the docx2pdf module: terminal > "pip install docx2pdf" (Microsoft Word must be installed)
+	For the "libreoffice" backend: LibreOffice (the 'soffice' program must be on the PATH, or set its location with 'sofficePath')
+'''
+
+# MODULES =========================================
+
+import os
+import shutil
+import tempfile
+import threading
+import subprocess
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from runStats import stats
+
+# FUNCTIONS =======================================
+
+def convert_docx2pdf(path, outFolder, worker):
+	from docx2pdf import convert # only imported when used, since it needs Microsoft Word
+	try:
+		import pythoncom # Word is driven through COM on Windows, which must be initialized in every thread that uses it
+		pythoncom.CoInitialize()
+	except ImportError: pass
+	convert(path, outFolder)
+
+def convert_libreoffice(path, outFolder, worker):
+	res = subprocess.run(
+		[worker.sofficePath, "--headless", "--norestore", "-env:UserInstallation=" + worker.profileUrl, "--convert-to", "pdf", "--outdir", outFolder, path],
+		stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=600)
+	pdf = os.path.join(outFolder, os.path.splitext(os.path.basename(path))[0] + ".pdf")
+	if (res.returncode != 0) or not os.path.exists(pdf):
+		raise RuntimeError("soffice exited with code " + str(res.returncode) + ": " + res.stdout.decode(errors="replace").strip())
+
+BACKENDS = {
+	"docx2pdf": convert_docx2pdf,
+	"libreoffice": convert_libreoffice,
+}
+
+# DATA TYPES =======================================
+
+class PdfConverter:
+	def __init__(self, backend="docx2pdf", workers=1, sofficePath="soffice"):
+		if backend not in BACKENDS: raise ValueError("unknown PDF converter: " + str(backend) + " (expected one of: " + ", ".join(BACKENDS.keys()) + ")")
+		if (backend == "libreoffice") and (shutil.which(sofficePath) is None): raise ValueError("LibreOffice was not found: " + sofficePath)
+
+		self.backend = backend
+		self.workers = 1 if backend == "docx2pdf" else max(1, workers)
+		self.sofficePath = sofficePath
+		self.pool = ThreadPoolExecutor(max_workers=self.workers)
+		self.failed = [] # list of (path, error)
+		self.local = threading.local() # each thread's worker state (LibreOffice profile)
+		self.profiles = [] # temporary folders, removed by close()
+		self.lock = threading.Lock()
+
+	def _worker(self):
+		if not hasattr(self.local, "worker"):
+			with self.lock:
+				profile = tempfile.mkdtemp(prefix="pdfConverter-")
+				self.profiles.append(profile)
+			self.local.worker = SimpleNamespace(sofficePath=self.sofficePath, profileUrl="file:///" + os.path.abspath(profile).replace("\\", "/").lstrip("/"))
+		return self.local.worker
+
+	def _convert(self, path, outFolder, onDone):
+		try:
+			with stats.time("pdfConvert", 1): BACKENDS[self.backend](path, outFolder, self._worker())
+		except Exception as e:
+			with self.lock: self.failed.append((path, e))
+			if onDone is not None: onDone(e)
+			return
+		if onDone is not None: onDone(None)
+
+	# Queues a conversion of the .docx file at 'path' to a PDF in 'outFolder'. 'onDone' (optional) is called from the worker thread once its done, with None, or the error if the conversion failed
+	def submit(self, path, outFolder, onDone=None):
+		return self.pool.submit(self._convert, path, outFolder, onDone)
+
+	# Waits for every queued conversion to finish. Returns the list of (path, error) of the conversions which failed
+	def close(self):
+		self.pool.shutdown(wait=True)
+		for profile in self.profiles: shutil.rmtree(profile, ignore_errors=True)
+		return self.failed
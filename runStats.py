@@ -0,0 +1,157 @@
+'''
+runStats.py
+
+Function: Per-stage timing and throughput instrumentation for translateSubtitles.py and translateWord.py
+	Each stage (reading, parsing, model loading, translating, saving, PDF conversion..) records how long it took, how many items it handled, and how many tokens went in and out of the model
+	Nested stages are timed exclusively (time spent in a nested stage isnt counted again in the stage around it), so the stage times of a run add up
+	At the end of a run, a summary table is printed, and a JSON or Prometheus textfile report can be written
+
+Requirements:
+	Python
+'''
+
+# MODULES =========================================
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# FUNCTIONS =======================================
+
+# Approximate amount of tokens in a string (whitespace separated words). Good enough to compare runs, without loading a tokenizer
+def countTokens(text):
+	return len(text.split()) if text else 0
+
+# DATA TYPES =======================================
+
+class RunStats:
+	def __init__(self):
+		self.lock = threading.Lock() # prefetching records stats from a background thread
+		self.local = threading.local() # per-thread stack of nested stages
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.stages = OrderedDict() # stage name -> SimpleNamespace(calls, seconds, items, tokensIn, tokensOut, slowest)
+			self.files = [] # list of [filename, seconds, segments], one for each translated file (and target language)
+			self.start = time.perf_counter()
+
+	def add(self, stage, seconds, items=0, tokensIn=0, tokensOut=0, calls=1, slowest=None):
+		with self.lock:
+			if stage not in self.stages: self.stages[stage] = SimpleNamespace(calls=0, seconds=0.0, items=0, tokensIn=0, tokensOut=0, slowest=0.0)
+			s = self.stages[stage]
+			s.calls += calls
+			s.seconds += seconds
+			s.items += items
+			s.tokensIn += tokensIn
+			s.tokensOut += tokensOut
+			s.slowest = max(s.slowest, seconds if slowest is None else slowest)
+
+	def _stack(self):
+		if not hasattr(self.local, "stack"): self.local.stack = []
+		return self.local.stack
+
+	def _begin(self):
+		self._stack().append(0.0) # time spent in nested stages
+		return time.perf_counter()
+
+	def _end(self, stage, start, items=0, tokensIn=0, tokensOut=0):
+		seconds = time.perf_counter() - start
+		stack = self._stack()
+		nested = stack.pop()
+		if len(stack) > 0: stack[-1] += seconds # the whole stage counts as nested time for the stage around it
+		self.add(stage, seconds - nested, items, tokensIn, tokensOut)
+
+	# Context manager which times a stage. Counts can be filled in while the stage runs, through the yielded SimpleNamespace. ex:
+		# with stats.time("translate") as s:
+		# 	res = model.translate(texts)
+		# 	s.items = len(texts)
+	@contextmanager
+	def time(self, stage, items=0):
+		counts = SimpleNamespace(items=items, tokensIn=0, tokensOut=0)
+		start = self._begin()
+		try: yield counts
+		finally: self._end(stage, start, counts.items, counts.tokensIn, counts.tokensOut)
+
+	# Generator which passes on the items of 'iterable', timing how long it takes to produce each of them (for stages which are streamed, like reading and parsing)
+	def timedIter(self, stage, iterable):
+		iterator = iter(iterable)
+		while True:
+			start = self._begin()
+			try: item = next(iterator)
+			except StopIteration:
+				self._end(stage, start)
+				return
+			except BaseException:
+				self._end(stage, start)
+				raise
+			self._end(stage, start, items=1)
+			yield item
+
+	def fileDone(self, filename, seconds, segments):
+		with self.lock: self.files.append([filename, seconds, segments])
+
+	# Adds the stats of another RunStats (ex: from a worker process, see snapshot())
+	def merge(self, snapshot):
+		for stage, s in snapshot["stages"].items():
+			self.add(stage, s["seconds"], s["items"], s["tokensIn"], s["tokensOut"], s["calls"], s["slowest"])
+		with self.lock: self.files += snapshot["files"]
+
+	# Returns the stats as a dictionary (which can be pickled, or written as JSON)
+	def snapshot(self):
+		with self.lock:
+			return {
+				"seconds": time.perf_counter() - self.start,
+				"stages": {k: dict(vars(v)) for k, v in self.stages.items()},
+				"files": [list(v) for v in self.files],
+			}
+
+	# Returns a summary table of every stage, and the slowest files
+	def table(self, amtSlowest=5):
+		snap = self.snapshot()
+		lines = ["Run stats (" + str(round(snap["seconds"], 2)) + "s total):"]
+		lines.append("  %-16s %8s %10s %7s %10s %12s %12s %10s" % ("stage", "calls", "seconds", "%", "items", "items/s", "tokens in", "tokens out"))
+		for stage, s in snap["stages"].items():
+			lines.append("  %-16s %8d %10.3f %6.1f%% %10d %12s %12d %10d" % (
+				stage, s["calls"], s["seconds"],
+				(s["seconds"] / snap["seconds"] * 100) if snap["seconds"] > 0 else 0,
+				s["items"], (str(round(s["items"] / s["seconds"], 1)) if (s["seconds"] > 0 and s["items"] > 0) else "-"),
+				s["tokensIn"], s["tokensOut"]))
+
+		untracked = snap["seconds"] - sum([s["seconds"] for s in snap["stages"].values()])
+		if untracked > 0: lines.append("  %-16s %8s %10.3f %6.1f%%" % ("(untracked)", "", untracked, (untracked / snap["seconds"] * 100) if snap["seconds"] > 0 else 0))
+
+		if len(snap["files"]) > 0:
+			lines.append("  Slowest files:")
+			for filename, seconds, segments in sorted(snap["files"], key=lambda v: v[1], reverse=True)[:amtSlowest]:
+				lines.append("  - " + filename + ": " + str(round(seconds, 2)) + "s, " + str(segments) + " segment(s)")
+		return "\n".join(lines)
+
+	# Writes a report to 'path': JSON if it ends with .json, otherwise the Prometheus textfile format (for node_exporter's textfile collector)
+	def write(self, path):
+		snap = self.snapshot()
+		if path.endswith(".json"):
+			with open(path, mode="w", encoding="utf-8") as f: json.dump(snap, f, indent=2)
+			return
+
+		lines = ["# HELP translate_run_seconds Duration of the translation run", "# TYPE translate_run_seconds gauge", "translate_run_seconds " + str(snap["seconds"])]
+		for metric, key, description in [
+			("translate_stage_seconds", "seconds", "Time spent in each stage"),
+			("translate_stage_calls", "calls", "Amount of times each stage ran"),
+			("translate_stage_items", "items", "Amount of items (subtitles, segments, files..) handled by each stage"),
+			("translate_stage_tokens_in", "tokensIn", "Approximate amount of tokens sent to the model"),
+			("translate_stage_tokens_out", "tokensOut", "Approximate amount of tokens returned by the model"),
+		]:
+			lines.append("# HELP " + metric + " " + description)
+			lines.append("# TYPE " + metric + " gauge")
+			for stage, s in snap["stages"].items(): lines.append(metric + "{stage=\"" + stage + "\"} " + str(s[key]))
+
+		# write to a temporary file first, so that the collector never reads a half-written file
+		with open(path + ".tmp", mode="w", encoding="utf-8") as f: f.write("\n".join(lines) + "\n")
+		os.replace(path + ".tmp", path)
+
+stats = RunStats() # shared by every module of the process
@@ -0,0 +1,29 @@
+from modelRegistry import ModelOrganiser
+
+def _models(tmp_path, pairs):
+	models = {}
+	for s, t in pairs:
+		folder = tmp_path / (s + "-" + t)
+		folder.mkdir()
+		(folder / "model.bin").write_bytes(bytes(1024 * 1024)) # 1 MB
+		models[str(folder) + "/"] = [s, t]
+	return models
+
+def test_model_in_use_isnt_unloaded(tmp_path):
+	loads = []
+	def loader(path, backend):
+		loads.append(path)
+		return path
+	models = ModelOrganiser(_models(tmp_path, [("en", "fr"), ("en", "de"), ("en", "it")]), memoryBudget=1, loader=loader)
+
+	with models.use("en", "fr") as fr:
+		assert models.get("en", "de") != fr # over budget, but "en-fr" is still in use
+		assert models.get("en", "fr") == fr
+		assert models.unloads == 0
+	models.get("en", "it") # neither is in use anymore
+	assert models.unloads == 2
+	assert len(loads) == 3
+
+def test_memory_key_includes_backend():
+	assert ModelOrganiser({"opus-mt-en-fr/": ["en", "fr"]}).memoryKey("en", "fr") == "opus-mt-en-fr/ (torch)"
+	assert ModelOrganiser({"opus-mt-en-fr/": ["en", "fr", "int8"]}).memoryKey("en", "fr") == "opus-mt-en-fr/ (int8)"
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+import textEncoding
+
+SRT = "1\n00:00:01,000 --> 00:00:02,000\n{}\n\n"
+
+def test_western_cp1252_isnt_read_as_gb18030():
+	data = SRT.format("…Müller fährt über die Brücke.").encode("cp1252")
+	assert textEncoding.detectEncoding(data, complete=True) == "cp1252"
+	assert textEncoding.decode(data)[0] == SRT.format("…Müller fährt über die Brücke.")
+
+def test_chinese_gb18030_isnt_read_as_cp1252():
+	for line in ["你好，世界", "我们明天见。", "他用Windows系统"]:
+		assert textEncoding.detectEncoding(SRT.format(line).encode("gb18030"), complete=True) == "gb18030"
+
+def test_utf8_and_boms():
+	assert textEncoding.detectEncoding(SRT.format("Grüße").encode("utf-8"), complete=True) == "utf-8"
+	assert textEncoding.detectEncoding(SRT.format("Grüße").encode("utf-8-sig")) == "utf-8-sig"
+	assert textEncoding.detectEncoding(SRT.format("Grüße").encode("utf-16")) == "utf-16"
+	assert textEncoding.detectEncoding(SRT.format("Hello there").encode("utf-16-le")) == "utf-16-le"
+
+def test_dos_end_of_file_and_form_feeds():
+	assert textEncoding.detectEncoding(SRT.format("Grüße\x0c").encode("utf-8") + b"\x1a", complete=True) == "utf-8"
+	data = SRT.format("Müller fährt\x0c").encode("cp1252") + b"\x1a"
+	assert textEncoding.detectEncoding(data, complete=True) == "cp1252"
+	assert textEncoding.decode(data)[0].endswith("\x1a")
+
+@pytest.mark.parametrize("data", [os.urandom(4000), bytes(range(256))])
+def test_binary_isnt_decoded(data):
+	assert textEncoding.detectEncoding(data, complete=True) is None
+	with pytest.raises(UnicodeError): textEncoding.decode(data)
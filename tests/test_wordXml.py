@@ -0,0 +1,74 @@
+import zipfile
+
+import pytest
+
+docx = pytest.importorskip("docx")
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+
+import wordXml
+
+W = wordXml.W
+
+def _translate(doc, model=str.upper): # same as translateWord.py's Translate.applySegments
+	segments = wordXml.collectSegments(doc)
+	for seg in segments:
+		for r in seg.runs: r.text = ""
+		seg.runs[seg.target].text = seg.lead + model(seg.text) + seg.trail
+	return segments
+
+def _partXml(path, name):
+	with zipfile.ZipFile(path) as z: return z.read(name).decode("utf-8")
+
+def test_page_field_in_footer(tmp_path):
+	d = docx.Document()
+	d.add_paragraph("Body text.")
+	footer = d.sections[0].footer.paragraphs[0]
+	footer._p.append(parse_xml('<w:r ' + nsdecls("w") + '><w:t xml:space="preserve">Page </w:t></w:r>'))
+	footer._p.append(parse_xml('<w:r ' + nsdecls("w") + '><w:fldChar w:fldCharType="begin"/></w:r>'))
+	footer._p.append(parse_xml('<w:r ' + nsdecls("w") + '><w:instrText xml:space="preserve"> PAGE </w:instrText></w:r>'))
+	footer._p.append(parse_xml('<w:r ' + nsdecls("w") + '><w:fldChar w:fldCharType="separate"/></w:r>'))
+	footer._p.append(parse_xml('<w:r ' + nsdecls("w") + '><w:t>1</w:t></w:r>'))
+	footer._p.append(parse_xml('<w:r ' + nsdecls("w") + '><w:fldChar w:fldCharType="end"/></w:r>'))
+	d.save(tmp_path / "in.docx")
+
+	doc = wordXml.Document(str(tmp_path / "in.docx"))
+	segments = _translate(doc)
+	assert sorted([seg.text for seg in segments]) == ["Body text.", "Page"]
+	doc.save(str(tmp_path / "out.docx"))
+
+	footerName = [v for v in doc.parts if v.startswith("word/footer")][0]
+	root = wordXml.Document(str(tmp_path / "out.docx")).parts[footerName]
+	runs = root.findall(".//" + W + "r")
+	assert [wordXml.Run(r).text for r in runs] == ["PAGE ", "", "", "", "1", ""] # the field's result is untouched
+	assert "PAGE" in _partXml(tmp_path / "out.docx", footerName) # instruction kept
+
+def test_hyperlink_stays_a_link(tmp_path):
+	d = docx.Document()
+	p = d.add_paragraph("See ")
+	p._p.append(parse_xml('<w:hyperlink ' + nsdecls("w", "r") + ' r:id="rId99"><w:r><w:t>the manual</w:t></w:r></w:hyperlink>'))
+	p._p.append(parse_xml('<w:r ' + nsdecls("w") + '><w:t xml:space="preserve"> for details.</w:t></w:r>'))
+	d.save(tmp_path / "in.docx")
+
+	doc = wordXml.Document(str(tmp_path / "in.docx"))
+	segments = _translate(doc)
+	assert [seg.text for seg in segments] == ["See", "the manual", "for details."]
+	doc.save(str(tmp_path / "out.docx"))
+
+	body = wordXml.Document(str(tmp_path / "out.docx")).parts[wordXml.DOCUMENT_PART]
+	link = body.find(".//" + W + "hyperlink")
+	assert "".join([wordXml.Run(r).text for r in link.iter(W + "r")]) == "THE MANUAL"
+
+def test_whitespace_around_hyperlink_is_kept(tmp_path):
+	d = docx.Document()
+	p = d.add_paragraph("See ")
+	p._p.append(parse_xml('<w:hyperlink ' + nsdecls("w", "r") + ' r:id="rId99"><w:r><w:t>the manual</w:t></w:r></w:hyperlink>'))
+	p._p.append(parse_xml('<w:r ' + nsdecls("w") + '><w:t xml:space="preserve"> for details.</w:t></w:r>'))
+	d.save(tmp_path / "in.docx")
+
+	doc = wordXml.Document(str(tmp_path / "in.docx"))
+	_translate(doc, lambda v: v.strip().upper()) # like a model, the stub drops the whitespace around the text
+	doc.save(str(tmp_path / "out.docx"))
+
+	body = wordXml.Document(str(tmp_path / "out.docx")).parts[wordXml.DOCUMENT_PART]
+	assert "".join([wordXml.Run(r).text for r in body.iter(W + "r")]) == "SEE THE MANUAL FOR DETAILS."
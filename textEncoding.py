@@ -0,0 +1,89 @@
+'''
+textEncoding.py
+
+Function: Works out the encoding of a text file from its first bytes (used by translateSubtitles.py and translateServer.py), so that the file only needs to be read, and decoded, once
+	A byte order mark (BOM) decides right away (UTF-8, UTF-16, UTF-32)
+	UTF-16 without a BOM is recognised by its zero bytes
+	Otherwise, the start of the file is decoded with each candidate encoding in turn, and the first one which fits is used
+		a single-byte encoding doesnt fit if the text it decodes to contains a NUL character, or a lot of control characters (binary files, or text in another single-byte encoding). A few are fine (ex: the Ctrl-Z at the end of DOS files, form feeds)
+		UTF-8 only fits actual UTF-8 text, so its control characters arent checked (except NUL)
+		multi-byte East Asian encodings (ex: GB18030) only fit if the text they decode to is mostly East Asian characters, which arent stuck between two Latin letters. They decode a lot of Western text without errors (ex: cp1252 "Müller" is "M黮ler" in GB18030)
+	Single-byte encodings which decode any byte (ex: latin-1) shouldnt be used as a last resort: with them, nothing is ever left undecodable
+
+Requirements:
+	Python
+'''
+
+# MODULES =========================================
+
+import codecs
+
+# DATA ============================================
+
+BOMS = [ # checked in this order (the UTF-32 LE BOM starts with the UTF-16 LE BOM)
+	(codecs.BOM_UTF32_LE, "utf-32"),
+	(codecs.BOM_UTF32_BE, "utf-32"),
+	(codecs.BOM_UTF8, "utf-8-sig"),
+	(codecs.BOM_UTF16_LE, "utf-16"),
+	(codecs.BOM_UTF16_BE, "utf-16"),
+]
+EAST_ASIAN = set(["gb18030", "gbk", "gb2312", "big5", "big5hkscs", "shift_jis", "cp932", "euc_jp", "euc_kr", "cp949"]) # encodings which must decode to East Asian text to be trusted
+EAST_ASIAN_RANGES = [(0x2E80, 0x9FFF), (0xAC00, 0xD7AF), (0xF900, 0xFAFF), (0xFF00, 0xFFEF)] # CJK, kana, hangul, full-width forms
+UNICODE = set(["utf-8", "utf-8-sig", "utf-16", "utf-16-le", "utf-16-be", "utf-32", "utf-32-le", "utf-32-be"]) # encodings which rarely decode anything but actual text
+CONTROL = set([chr(v) for v in list(range(0x00, 0x20)) + list(range(0x7F, 0xA0))]) - set(["\t", "\n", "\r"]) # characters which are rare in text files
+CONTROL_SHARE = 0.05 # text decoded with a single-byte encoding doesnt fit if more than this share of its characters are in CONTROL
+
+# FUNCTIONS =======================================
+
+# Decodes 'data' with 'encoding', or returns None if it doesnt fit
+# 'complete' is whether or not 'data' is the whole file (otherwise, a character cut off at the end of 'data' isnt an error)
+def _decode(data, encoding, complete):
+	try: return codecs.getincrementaldecoder(encoding)().decode(data, final=complete)
+	except UnicodeDecodeError: return None
+
+def _isEastAsian(c):
+	return any([first <= ord(c) <= last for first, last in EAST_ASIAN_RANGES])
+
+def _isLatinLetter(c):
+	return c.isascii() and c.isalpha()
+
+# Whether or not text decoded with 'encoding' looks like it was actually written in that encoding
+def _plausible(text, encoding):
+	if "\x00" in text: return False
+	name = codecs.lookup(encoding).name
+	if name in UNICODE: return True
+	if len([c for c in text if c in CONTROL]) > CONTROL_SHARE * len(text): return False
+	if name not in EAST_ASIAN: return True
+	nonAscii = [i for i, c in enumerate(text) if ord(c) > 127]
+	if len(nonAscii) == 0: return True
+	eastAsian = [i for i in nonAscii if _isEastAsian(text[i])]
+	if len(eastAsian) < 0.9 * len(nonAscii): return False
+	# a Western letter followed by an ASCII byte decodes to a single East Asian character, between the Latin letters around it (ex: "Müller" -> "M黮ler"). East Asian text rarely has those
+	stuck = [i for i in eastAsian if (0 < i < len(text) - 1) and _isLatinLetter(text[i-1]) and _isLatinLetter(text[i+1])]
+	return len(stuck) <= 0.2 * len(eastAsian)
+
+# Returns the encoding of a file, given its first bytes ('prefix'), or None if none of the 'candidates' fit
+# 'complete' is whether or not 'prefix' is the whole file
+def detectEncoding(prefix, candidates=["utf-8", "gb18030", "cp1252"], complete=False):
+	for bom, encoding in BOMS:
+		if prefix.startswith(bom): return encoding
+
+	sample = prefix[:4096]
+	half = len(sample) // 2
+	if half >= 8: # UTF-16 without a BOM: ASCII characters have a zero byte either before or after them
+		zerosEven, zerosOdd = sample[0::2].count(0), sample[1::2].count(0)
+		if (zerosOdd > 0.3 * half) and (zerosEven < 0.05 * half): return "utf-16-le"
+		if (zerosEven > 0.3 * half) and (zerosOdd < 0.05 * half): return "utf-16-be"
+
+	for encoding in candidates:
+		text = _decode(prefix, encoding, complete)
+		if (text is not None) and _plausible(text, encoding): return encoding
+	return None
+
+# Decodes a whole file's content (bytes). Returns (text, encoding). Raises a UnicodeError if it cant be decoded
+# only the first 'detectBytes' bytes are used to work out the encoding
+def decode(data, candidates=["utf-8", "gb18030", "cp1252"], detectBytes=65536):
+	encoding = detectEncoding(data[:detectBytes], candidates, len(data) <= detectBytes)
+	if encoding is None: raise UnicodeError("couldnt work out the encoding (tried: " + ", ".join(candidates) + ")")
+	try: return data.decode(encoding), encoding
+	except UnicodeDecodeError as e: raise UnicodeError("not valid " + encoding + " past the start of the file (" + str(e) + ")")
@@ -0,0 +1,132 @@
+'''
+textFilter.py
+
+Function: Decides what to do with a string before it is sent to the translation model (used by translateSubtitles.py and translateWord.py)
+	Some strings make the model return garbage, and some dont need translating at all. Those are caught here with precompiled patterns, in a single check per rule, so that the model only sees text that needs translating
+	Extra patterns for text which should be left as-is (codes, URLs, numbers..) can be configured
+	Counts how often each rule fires, so that its easy to see what is being kept away from the model
+	Spans of text which the model shouldnt translate (tags, URLs, numbers..) can be masked with placeholders, and restored after translation (see Masker)
+
+Requirements:
+	Python
+'''
+
+# MODULES =========================================
+
+import re
+import threading
+from collections import Counter
+
+# DATA ============================================
+
+# some characters / combinations of characters will make the translater return some wacky stuff.
+# known cases:
+	# strings containing only numbers (and perhaps spaces and periods)
+	# the '≈' symbol on its own
+	# "NUMBER. (SOME_TEXT)" this will cause the translator to go on about the european council and some other bullshit
+	# greek letters, when translated alone, make the translator output nonsense
+	# the letter 'r' (by itself) . It makes the translator spit out some garbage. Im going to pre-emptively avoid translating any single letters.
+	# "TEXT!)." the translator returns the text, exclamation mark, and closed parenthesis followed by a bunch of periods
+BLANK = re.compile(r"[ \t]*")
+NUMBER = re.compile(r"[\d \t.]+")
+SYMBOLS = set(["≈"])
+NUMBERED = re.compile(r"(\d\.)(.+)", re.DOTALL) # "1. text"
+TRAILING_DOTS = re.compile(r"(.*?!\))(\.+)", re.DOTALL) # "text!)...."
+PLACEHOLDER = re.compile(r"\{\s*(\d+)\s*\}") # placeholders put in by Masker (the model sometimes adds spaces inside them)
+
+# DATA TYPES =======================================
+
+class TextFilter:
+	def __init__(self, passthroughPatterns=[]):
+		# strings which fully match any of these are left as-is
+		self.passthrough = re.compile("|".join(["(?:" + v + ")" for v in passthroughPatterns])) if len(passthroughPatterns) > 0 else None
+		self.counts = Counter() # rule -> amount of times it fired
+		self.lock = threading.Lock()
+
+	def count(self, rule, counted):
+		if not counted: return
+		with self.lock: self.counts[rule] += 1
+
+	# Returns a "plan" for a string, which is one of:
+		# ["done", result, text]: the string doesnt need to be translated. 'result' is used as-is
+		# ["translate", text]: the string is sent to the translator
+		# ["wrap", prefix, innerPlan, suffix, text]: only part of the string is translated (according to 'innerPlan'), and the prefix / suffix are re-attached afterwards
+	# optional parameter 'counted' is whether or not this check is included in the rule counts (False for checks which dont lead to a translation)
+	def plan(self, text, counted=True):
+		if (text is None) or BLANK.fullmatch(text):
+			self.count("blank", counted)
+			return ["done", "", text]
+		if NUMBER.fullmatch(text) or (text in SYMBOLS):
+			self.count("number", counted)
+			return ["done", text, text]
+		if (self.passthrough is not None) and self.passthrough.fullmatch(text):
+			self.count("passthrough", counted)
+			return ["done", text, text]
+
+		if len(text) > 2:
+			m = NUMBERED.fullmatch(text)
+			if m is not None:
+				self.count("numberedPrefix", counted)
+				return ["wrap", m.group(1), self.plan(m.group(2), counted), "", text]
+		elif len(text) == 1:
+			self.count("singleCharacter", counted)
+			return ["done", text, text]
+
+		if "!)." in text:
+			m = TRAILING_DOTS.fullmatch(text)
+			if m is not None:
+				self.count("trailingDots", counted)
+				return ["wrap", "", self.plan(m.group(1), counted), m.group(2), text]
+
+		self.count("translate", counted)
+		return ["translate", text]
+
+	def report(self):
+		if sum(self.counts.values()) == 0: return "Text filter: nothing filtered"
+		return "Text filter: " + ", ".join([rule + " " + str(amt) for rule, amt in self.counts.most_common()])
+
+# Swaps spans which the model shouldnt touch (tags, URLs, numbers..) for short placeholders ("{0}", "{1}"..) before translation, and puts them back afterwards
+# this makes the model's input shorter, and keeps it from mangling (or being confused by) things which arent words
+class Masker:
+	def __init__(self, maskPatterns=[]):
+		# text which already looks like a placeholder is masked too, so that it cant be mistaken for one
+		self.pattern = re.compile("|".join(["(?:" + v + ")" for v in [r"\{\d+\}"] + maskPatterns]))
+		self.masked = 0 # amount of spans masked
+		self.lost = 0 # amount of translations which lost (or duplicated) a placeholder, and were translated again without masking
+		self.lock = threading.Lock()
+
+	# Returns the masked text, and the list of spans which were masked (placeholder "{i}" stands for spans[i])
+	def mask(self, text):
+		spans = []
+		def placeholder(m):
+			spans.append(m.group(0))
+			return "{" + str(len(spans) - 1) + "}"
+		return self.pattern.sub(placeholder, text), spans
+
+	# Puts the masked spans back into a translation. Returns None if the translation doesnt contain every placeholder exactly once
+	def unmask(self, text, spans):
+		if sorted([int(v) for v in PLACEHOLDER.findall(text)]) != list(range(len(spans))): return None
+		return PLACEHOLDER.sub(lambda m: spans[int(m.group(1))], text)
+
+	# Translates a list of strings with 'translate' (a function which takes a list of strings, and returns a list of translated strings), masking them first
+	# strings which are nothing but masked spans (and punctuation) arent sent to the model at all
+	def translate(self, texts, translate):
+		res = [None] * len(texts)
+		masked = [self.mask(v) for v in texts]
+		send = [] # indexes of the strings sent to the model
+		for i, (text, spans) in enumerate(masked):
+			if (len(spans) > 0) and not any([v.isalpha() for v in PLACEHOLDER.sub("", text)]): res[i] = texts[i]
+			else: send.append(i)
+		with self.lock: self.masked += sum([len(spans) for text, spans in masked])
+
+		retry = []
+		for i, translated in zip(send, translate([masked[i][0] for i in send])):
+			res[i] = self.unmask(translated, masked[i][1])
+			if res[i] is None: retry.append(i)
+		if len(retry) > 0:
+			with self.lock: self.lost += len(retry)
+			for i, translated in zip(retry, translate([texts[i] for i in retry])): res[i] = translated
+		return res
+
+	def report(self):
+		return "Masking: " + str(self.masked) + " span(s) masked, " + str(self.lost) + " translation(s) lost a placeholder and were translated again without masking"
@@ -0,0 +1,239 @@
+'''
+translateServer.py
+
+Function: Keeps translation models loaded, and translates subtitles, Word documents and text sent to it over a local port (or Unix socket)
+	translateSubtitles.py and translateWord.py import torch/easynmt and load their models on every run. For many small files, that startup takes longer than the translating. The server only pays it once, and every request after that uses the models which are already loaded
+	Requests are handled at the same time, each in its own thread. Model calls from concurrent requests are merged into shared batches, and identical strings waiting at the same time are only translated once (see batchScheduler.py)
+	The translation memory is shared with translateSubtitles.py and translateWord.py
+
+Usage:
+	Start the server: terminal > "python translateServer.py" (stop it with Ctrl+C)
+	Subtitles: terminal > curl --data-binary @movie.srt "http://127.0.0.1:8765/srt?source=en&target=fr" -o "movie -fr.srt"
+	Word documents: terminal > curl --data-binary @report.docx "http://127.0.0.1:8765/docx?source=en&target=fr" -o "report -fr.docx"
+	Text: terminal > curl -d "{\"texts\": [\"Hello.\", \"Goodbye.\"], \"source\": \"en\", \"target\": \"fr\"}" http://127.0.0.1:8765/text
+		returns: {"translations": [...]}
+	Loaded models, translation memory and batching statistics: terminal > curl http://127.0.0.1:8765/status
+	With cfg.unixSocket, add '--unix-socket <path>' to the curl commands
+
+Requirements:
+	Python
+	translateSubtitles.py, translateWord.py and batchScheduler.py (and the modules they need) in the same folder as this python file
+	Models are taken from translateSubtitles.py's cfg.translateModels and translateWord.py's cfg.translationModels. Translation options (batch size, masking, decode limits, .srt encodings..) are taken from those scripts' configs
+'''
+
+# CONFIG ==========================================
+
+from types import SimpleNamespace
+cfg = SimpleNamespace(**{
+	"host": "127.0.0.1", # address to listen on. "127.0.0.1" only accepts connections from this computer
+	"port": 8765,
+	"unixSocket": "", # path of a Unix socket to listen on, instead of host:port ("" = use host:port) (not available on Windows)
+
+	"maxBatch": 64, # max amount of strings sent to the model in one call. Batches from concurrent requests are merged up to this size
+	"maxBatchTokens": 2048, # max amount of tokens (whitespace separated words) sent to the model in one call (0 = no limit)
+	"batchWait": 0.01, # max amount of time (in seconds) a batch waits for batches from other requests to join it
+	"maxRequestSize": 100, # max size (MB) of an uploaded file
+
+	"threads": 0, # amount of CPU threads the translation models use per batch (0 = let the backend decide) (see cpuAffinity.py)
+	"interOpThreads": 0, # amount of batches the models may run side by side (0 = let the backend decide)
+	"modelMemoryBudget": 0, # max amount of memory (MB) used by loaded translation models. When exceeded, the least recently used model is unloaded (0 = no limit)
+	"translationMemory": True, # remember translations on disk, so that repeated text doesnt need to be translated again
+	"translationMemoryPath": "translationMemory.sqlite3", # file in which translations are remembered (shared with translateSubtitles.py and translateWord.py)
+	"translationMemorySize": 200000, # max amount of remembered translations. The least recently used ones are forgotten first
+
+	"verbosity": 1, # 0: only print errors, 1: print every request
+})
+
+# MODULES ========================================
+
+try:
+	import os
+	import io
+	import json
+	import time
+	import tempfile
+	import socketserver
+	from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+	from urllib.parse import urlsplit, parse_qs
+
+	import translateSubtitles as ts # .srt parsing and writing, and text translation
+	import translateWord as tw # .docx loading and saving
+	from modelRegistry import ModelOrganiser # loads NMT translation models when theyre needed
+	from translationMemory import TranslationMemory # on-disk cache of previous translations
+	from batchScheduler import BatchScheduler # merges model calls from concurrent requests
+	from runStats import stats # per-stage timing
+	import cpuAffinity # CPU thread counts
+	import textEncoding # works out the encoding of uploaded .srt files
+
+except Exception as e:
+	print("Error when importing modules: " + str(e))
+	raise SystemExit
+
+# DATA ============================================
+
+server = SimpleNamespace(**{
+	"models": None, # ModelOrganiser() shared by every request
+	"memory": None, # TranslationMemory() (or None if disabled)
+	"scheduler": None, # BatchScheduler()
+	"start": time.time(),
+	"requests": 0,
+	"failed": 0,
+})
+
+# FUNCTIONS =======================================
+
+# Translates a list of strings
+def translateTexts(texts, sourceLang, targetLang):
+	return ts.Translate.translateTexts_robust(texts, sourceLang, targetLang)
+
+# Translates the content of a .srt file (bytes), and returns the translated .srt file (utf-8 bytes)
+def translateSrt(data, sourceLang, targetLang):
+	try: text, encoding = textEncoding.decode(data, ts.cfg.encodings, ts.cfg.detectBytes)
+	except UnicodeError as e: raise ValueError("the .srt file couldnt be decoded: " + str(e))
+
+	out = io.StringIO()
+	try: amt = ts._writeSubtitles(ts._translateSubtitleStream(ts._readSubtitles(io.StringIO(text, newline=None)), sourceLang, targetLang), out)
+	except ts.SrtError as e: raise ValueError("the .srt file is malformed: " + str(e))
+	return out.getvalue().encode("utf-8"), amt
+
+# Translates the content of a .docx file (bytes), and returns the translated .docx file (bytes)
+def translateDocx(data, sourceLang, targetLang):
+	with tempfile.TemporaryDirectory() as folder:
+		folder += os.sep
+		with open(folder + "in.docx", "wb") as f: f.write(data)
+		try: loaded = tw.Translate.loadDoc("in.docx", folder)
+		except Exception as e: raise ValueError("the .docx file couldnt be read: " + str(e))
+
+		translations = tw.Translate.translateSegments(loaded.segments, sourceLang, targetLang)
+		tw.Translate.applySegments(loaded.segments, translations)
+		with stats.time("docSave", 1): loaded.doc.save(folder + "out.docx")
+		with open(folder + "out.docx", "rb") as f: return f.read(), len(loaded.segments)
+
+def status():
+	return {
+		"uptime": round(time.time() - server.start, 1),
+		"requests": server.requests,
+		"failed": server.failed,
+		"models": server.models.report(),
+		"memory": server.memory.report() if server.memory is not None else None,
+		"scheduler": server.scheduler.report(),
+		"decodeGuard": ts.Translate.decodeGuard.report(),
+		"stages": stats.table(),
+	}
+
+# DATA TYPES =======================================
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1" # keep connections open between requests
+
+	def send(self, code, body, contentType="application/json"):
+		if isinstance(body, (dict, list)): body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+		self.send_response(code)
+		self.send_header("Content-Type", contentType)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def fail(self, code, reason):
+		server.failed += 1
+		self.send(code, {"error": reason})
+
+	def do_GET(self):
+		if urlsplit(self.path).path == "/status": self.send(200, status())
+		else: self.fail(404, "unknown path: " + self.path)
+
+	def do_POST(self):
+		server.requests += 1
+		url = urlsplit(self.path)
+		query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+		length = int(self.headers.get("Content-Length", 0))
+		if length > cfg.maxRequestSize * 1024 * 1024:
+			self.close_connection = True # the request body isnt read
+			return self.fail(413, "request is larger than " + str(cfg.maxRequestSize) + "MB")
+		data = self.rfile.read(length)
+
+		try:
+			if url.path == "/text":
+				try: req = json.loads(data.decode("utf-8"))
+				except ValueError: return self.fail(400, "request body isnt valid JSON")
+				query = {"source": req.get("source"), "target": req.get("target")}
+				if not (isinstance(req.get("texts"), list) and all([isinstance(v, str) for v in req["texts"]])): return self.fail(400, "'texts' must be a list of strings")
+			elif url.path not in ["/srt", "/docx"]: return self.fail(404, "unknown path: " + url.path)
+
+			sourceLang, targetLang = query.get("source"), query.get("target")
+			if (sourceLang is None) or (targetLang is None): return self.fail(400, "'source' and 'target' languages are required")
+			if not server.models.has(sourceLang, targetLang): return self.fail(400, "no model with translation direction: " + sourceLang + "->" + targetLang + " configured")
+
+			start = time.perf_counter()
+			if url.path == "/text":
+				self.send(200, {"translations": translateTexts(req["texts"], sourceLang, targetLang)})
+				return
+			if url.path == "/srt":
+				body, amt = translateSrt(data, sourceLang, targetLang)
+				contentType = "application/x-subrip; charset=utf-8"
+			else:
+				body, amt = translateDocx(data, sourceLang, targetLang)
+				contentType = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+			stats.fileDone(url.path[1:] + " request (" + sourceLang + "->" + targetLang + ")", time.perf_counter() - start, amt)
+			self.send(200, body, contentType)
+
+		except ValueError as e: self.fail(400, str(e))
+		except Exception as e:
+			print("Error when handling " + self.path + ": " + repr(e))
+			self.fail(500, str(e))
+
+	def address_string(self):
+		return self.client_address[0] if isinstance(self.client_address, tuple) else "unix socket"
+
+	def log_message(self, format, *args):
+		if cfg.verbosity >= 1: print(self.address_string() + " - " + (format % args))
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+	class UnixServer(socketserver.ThreadingUnixStreamServer):
+		daemon_threads = True # unfinished requests dont keep the server from stopping
+
+# MAIN =============================================
+
+if __name__ == "__main__":
+	print("Config options:", str(vars(cfg)))
+	ts.cfg.testingMode = False # dont print every translated subtitle
+	cpuAffinity.applyThreads(cfg.threads, cfg.interOpThreads)
+	print(cpuAffinity.report())
+
+	# every request (subtitles, documents and text) uses the same models, translation memory and batch scheduler
+	server.models = ModelOrganiser({**ts.cfg.translateModels, **tw.cfg.translationModels}, cfg.modelMemoryBudget, pivotLanguage=ts.cfg.pivotLanguage)
+	ts.Translate.translateModels = tw.Translate.translateModels = server.models
+	if cfg.translationMemory: server.memory = TranslationMemory(cfg.translationMemoryPath, cfg.translationMemorySize)
+	ts.Translate.translationMemory = tw.Translate.translationMemory = server.memory
+	server.scheduler = BatchScheduler(ts.Translate.decodeGuard.translate, cfg.maxBatch, cfg.maxBatchTokens, cfg.batchWait)
+	ts.Translate.scheduler = tw.Translate.scheduler = server.scheduler
+
+	if cfg.unixSocket != "":
+		if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+			print("Unix sockets arent available on this system. Set cfg.unixSocket to \"\" to use host:port. Exiting...")
+			raise SystemExit
+		if os.path.exists(cfg.unixSocket): os.remove(cfg.unixSocket) # left over from a previous run
+		httpd = UnixServer(cfg.unixSocket, Handler)
+		print("Listening on " + cfg.unixSocket)
+	else:
+		httpd = ThreadingHTTPServer((cfg.host, cfg.port), Handler)
+		print("Listening on http://" + cfg.host + ":" + str(cfg.port))
+
+	try: httpd.serve_forever()
+	except KeyboardInterrupt: print("Stopping..")
+	finally:
+		httpd.server_close()
+		if cfg.unixSocket != "" and os.path.exists(cfg.unixSocket): os.remove(cfg.unixSocket)
+		server.scheduler.close()
+		ts.Translate.scheduler = tw.Translate.scheduler = None
+
+	print(server.models.report())
+	if server.memory is not None:
+		print(server.memory.report())
+		server.memory.close()
+	print(server.scheduler.report())
+	print(ts.Translate.decodeGuard.report())
+	print(stats.table())
+
+	print("End of script.")
@@ -6,7 +6,7 @@ Requirements:
 
 Limitations
 	Wont work for hardcoded subs
-	Sentences which span multiple time-ranges won't be translated accurately (subtitles for each time-range are translated individually, which can sometimes mean that theyre translated out of context.)
+	Sentences which span multiple time-ranges are merged and translated as a whole (see cfg.mergeSentences), then split back over the time-ranges. Where the split falls is an estimate, so a time-range can end up with a few words that belong to its neighbour
 '''
 
 # CONFIG ==========================================
@@ -26,6 +26,8 @@ cfg = SimpleNamespace(**{
 		# dictionary, whose:
 			# keys represent: folders containing pre-trained opus-mt translation models (folder names must end with "\\")
 			# values represent: a list containing the source and target language, respectively
+				# an optional third item picks how the model is run: "torch" (default), "int8" (quantized, faster on CPU), "ctranslate2" or "onnx" (converted once, and cached next to the model's folder). See inferenceBackend.py
+				# ex: "opus-mt-en-fr\\": ["en", "fr", "ctranslate2"],
 		"opus-mt-en-fr\\": ["en", "fr"],
 		"opus-mt-en-de\\": ["en", "de"],
 		"opus-mt-en-it\\": ["en", "it"],
@@ -35,10 +37,61 @@ cfg = SimpleNamespace(**{
 		"opus-mt-en-zh\\": ["en", "zh"],
 	},
 
+	"pivotLanguage": "en", # language pairs without a direct model are translated through this language (ex: de->en->zh), if models for both hops are configured ("" = only use direct models)
+	"pivotCacheSize": 100000, # max amount of intermediate (pivot language) translations kept in memory
+
+	"batchTranslation": True, # send subtitles to the translation model in batches, instead of one subtitle at a time
+	"batchSize": 32, # max amount of subtitles per batch (when batchTranslation is enabled)
+	"windowSize": 256, # amount of subtitles read, translated and written at a time. Only this many subtitles are kept in memory
+	"concurrentFiles": 1, # amount of .srt files translated at the same time. Above 1, batches from different files are merged before being sent to the model (see batchScheduler.py), so that small files still fill whole batches
+	"batchTokens": 2048, # max amount of tokens (whitespace separated words) in a merged batch (0 = no limit) (when concurrentFiles is above 1)
+	"batchWait": 0.05, # max amount of time (in seconds) a batch waits for batches from other files to join it (when concurrentFiles is above 1)
+	"encodings": ["utf-8", "gb18030", "cp1252"], # encodings tried (in this order) for .srt files without a byte order mark; the first one which fits the start of the file is used (see textEncoding.py). Files which none of them fit are skipped. Dont add "latin-1": it fits any file
+	"detectBytes": 65536, # amount of bytes at the start of each .srt file used to work out its encoding
+	"resume": True, # keep a journal of translated subtitles in interPath, so that an interrupted run continues where it stopped (and finished files are skipped)
+
+	"mergeSentences": True, # translate sentences which span several subtitles as a whole (more context for the model, and fewer, longer model calls), then split the translation back over the subtitles
+	"maxSentenceCues": 4, # max amount of subtitles merged into one sentence
+	"splitBy": "length", # how a merged translation is split over its subtitles: in proportion to each subtitle's "length" (amount of characters), or "duration" (time on screen)
+
+	"translationMemory": True, # remember translations on disk, so that repeated lines (and re-runs) dont need to be translated again
+	"translationMemoryPath": "translationMemory.sqlite3", # file in which translations are remembered (shared with translateWord.py)
+	"translationMemorySize": 200000, # max amount of remembered translations. The least recently used ones are forgotten first
+
+	"passthroughPatterns": [ # text which fully matches any of these regular expressions is left as-is, instead of being translated
+		r"(https?://|www\.)\S+", # URLs
+		r"[\w.+-]+@[\w-]+(\.[\w-]+)+", # email addresses
+		r"[\d\s.,:;/%+()\-–]+", # numbers, dates, times, percentages..
+		r"[A-Z]{1,5}[-_]?\d[\w./-]*", # codes (ex: "ISO-9001", "A4", "SKU123-45")
+	],
+
+	"maxNewTokens": 512, # max amount of tokens the model may generate for one text
+	"maxOutputRatio": 3, # translations more than this many times longer (in characters) than their input are treated as garbage. The model isnt allowed to generate more tokens than that either
+	"stopEarly": True, # stop generating as soon as the model gets stuck repeating itself, instead of running until the token limit
+	"masking": True, # swap tags, URLs, numbers.. for placeholders before translating, and put them back afterwards (shorter input for the model, and they cant be mangled)
+	"maskPatterns": [ # regular expressions of the spans which are masked
+		r"<[^<>]+>", # tags (ex: "<i>", "</font>")
+		r"\{\\[^{}]*\}", # override codes (ex: "{\an8}")
+		r"(https?://|www\.)\S+", # URLs
+		r"[\w.+-]+@[\w-]+(\.[\w-]+)+", # email addresses
+		r"(?<![\w.])\d+([.,:]\d+)*(?!\w|[.,:]\d)", # numbers (not part of a word, ex: "MP3", "4K")
+	],
+
+	"modelMemoryBudget": 0, # max amount of memory (MB) used by loaded translation models. When exceeded, the least recently used model is unloaded (0 = no limit)
+
+	# CPU placement (see cpuAffinity.py). Each option can also be set on the command line (see parseArgs)
+	"threads": 0, # amount of CPU threads the translation model uses per batch (0 = let the backend decide). With several copies of this script running at once, keep copies*threads <= amount of CPU cores
+	"interOpThreads": 0, # amount of batches the model may run side by side (0 = let the backend decide)
+	"pinCores": False, # pin this script to its own set of CPU cores, so that several copies running at once (see 'instance') dont fight over the same cores
+	"numaAware": True, # when pinning, only use cores from a single NUMA node
+	"instance": [0, 1], # when several copies of this script run side by side: [this copy's number (from 0), amount of copies]. Each copy is pinned to its own share of the cores
+
+	"statsReport": "", # file to write a timing report to at the end of the run: JSON if it ends with ".json", otherwise Prometheus textfile format ("" = only print the summary table)
+	"dryRun": False, # only read the .srt files, and report how much there is to translate (subtitles, segments, estimated tokens), without loading any translation model or writing any file
+
 	"verbosity": 4,
 	"testingMode": True,
 })
-print("Config options:", str(vars(cfg)))
 
 # MODULES ========================================
 
@@ -48,8 +101,19 @@ try:
 	import io
 	import shutil # copying files
 	import sys
-
-	from easynmt import EasyNMT, models # NMT translator
+	import time
+	import argparse
+
+	import cpuAffinity # CPU thread counts and core pinning
+	from modelRegistry import ModelOrganiser # loads NMT translation models when theyre needed
+	from translationMemory import TranslationMemory, LruCache # on-disk cache of previous translations
+	from translationJournal import Journal # checkpoints, to resume interrupted runs
+	from runStats import stats, countTokens # per-stage timing
+	from textFilter import TextFilter, Masker # keeps text which doesnt need translating away from the model
+	from decodeGuard import DecodeGuard # keeps the model from generating runaway output
+	from translationPipeline import Pipeline # filters, translation memory, masking, pivoting and batching of the text sent to the model
+	from batchScheduler import BatchScheduler # merges batches from files translated at the same time
+	from textEncoding import detectEncoding # works out the encoding of .srt files
 
 except Exception as e: 
 	print("Error when importing modules: " + str(e))
@@ -167,6 +231,8 @@ LANGUAGES = { # this is really just a dictionary showing languages and their abb
     'yo': 'yoruba',
     'zu': 'zulu'}
 
+skipped = [] # list of (filename, reason) for .srt files which couldnt be read
+
 # FUNCTIONS =======================================
 
 class G:
@@ -214,71 +280,19 @@ class G:
 		input("Press <ENTER> to exit")
 		raise SystemExit
 
-class Translate:
-	class ModelOrganiser: # data type containing translation models, and their input and output languages
-		def __init__(self):
-			self.repo = {} # 2D dictionary whose first dimension represents source languages, second dimension represents target languages
-
-		def add(self, path, sourceLang, targetLang):
-			if not (sourceLang in self.repo): self.repo[sourceLang] = {}
-			if targetLang in self.repo[sourceLang]: G.showErr(reason="Attempted to load a translation model whose source and target language already exists in ModelOrganiser()")
-			else: self.repo[sourceLang][targetLang] = EasyNMT(translator=models.AutoModel(path))
-
-		def get(self, sourceLang, targetLang):
-			if not(sourceLang in self.repo) or not(targetLang in self.repo[sourceLang]): G.showErr(reason="Attemped to use a translation model whose translation direction doesnt exist in ModelOrganiser()")
-			else: return self.repo[sourceLang][targetLang]
-
-	translateModels = ModelOrganiser() # class variable containing a ModelOrganiser()
-
-	def load_translateModels(): # for all the selected output languages, load the appropriate translation model from its folder
-		print("Loading translation models...")
-		for key in cfg.translateModels:
-			if (cfg.translateModels[key][0] == cfg.inLang) and (cfg.translateModels[key][1] in cfg.outLang):
-				Translate.translateModels.add(key, cfg.translateModels[key][0], cfg.translateModels[key][1])
-
-	def translateText(text, sourceLang, targetLang):
-		return Translate.translateModels.get(sourceLang, targetLang).translate(text, source_lang=sourceLang, target_lang=targetLang, max_new_tokens=512)
-
-	def translateText_robust(text, sourceLang, targetLang):
-		if cfg.verbosity >= 4: print("Translating text: " + G.wrap(text, "\""))
-
-		#if "\n" in text: return Translate.translateText_robust(text.replace("\n", " "), sourceLang, targetLang)
-
-		# some characters / combinations of characters will make the translater return some wacky stuff.
-		# known cases:
-			# strings containing only numbers (and perhaps spaces and periods)
-			# the '≈' symbol on its own
-			# "NUMBER. (SOME_TEXT)" this will cause the translator to go on about the european council and some other bullshit
-			# greek letters, when translated alone, make the translator output nonsense
-			# the letter 'r' (by itself) . It makes the translator spit out some garbage. Im going to pre-emptively avoid translating any single letters.
-			# "TEXT!)." the translator returns the text, exclamation mark, and closed parenthesis followed by a bunch of periods
-		# {
-		if (text is None) or (all([(v == " " or v == "\t") for v in text])): res = ""
-		elif all([(v.isnumeric() | (v==" ") | (v=="\t") | (v==".")) for v in text]): res = text # if every char in the string is either a number, a tab, a space, or a period
-		elif text == "≈": res = text # if the string contains only '≈'
-
-		elif (len(text) > 2) and (text[0].isnumeric()) & (text[1] == "."):
-			if cfg.verbosity >= 5: print("Recursing")
-			res = text[0:2] + Translate.translateText_robust(text[2:], sourceLang, targetLang)
-				
-		elif (len(text) == 1): res = text
-		
-		elif (text.find("!).") != -1) and (all([(v == ".") for v in text[text.find("!).")+2:]])):
-			res = (Translate.translateText_robust(text[:text.find("!).")+2], sourceLang, targetLang) + str(text[text.find("!).")+2:]))
-		# }
+class Translate(Pipeline): # the translation pipeline is in translationPipeline.py
+	options = cfg # class variable containing the config the pipeline uses
+	translateModels = ModelOrganiser(cfg.translateModels, cfg.modelMemoryBudget, pivotLanguage=cfg.pivotLanguage) # class variable containing a ModelOrganiser() (models are loaded when first needed)
+	translationMemory = None # class variable containing a TranslationMemory() (or None if disabled). Opened when the script runs
+	pivotCache = LruCache(cfg.pivotCacheSize) # class variable containing the intermediate text of pivot translations: (sourceLang, pivotLang, text) -> translation
+	textFilter = TextFilter(cfg.passthroughPatterns) # class variable containing a TextFilter()
+	masker = Masker(cfg.maskPatterns) # class variable containing a Masker()
+	decodeGuard = DecodeGuard(cfg.maxNewTokens, cfg.maxOutputRatio, cfg.stopEarly) # class variable containing a DecodeGuard()
+	scheduler = None # class variable containing a BatchScheduler() which model calls go through, or None to call the model directly (with cfg.concurrentFiles, or set by translateServer.py)
 
-		else:
-			res = Translate.translateText(text, sourceLang, targetLang)
-			if cfg.verbosity >= 5: print("Clear")
-
-		if (
-			len(res) > 3*len(text)
-			or (".........." in res)
-			or ("----------" in res)
-		):
-			if cfg.verbosity >= 4: print("Translation looks like some garbage. Using original un-translated text..")
-			return text # if the translator bugs and returns a bunch of garbage, return the original untranslated text
-		else: return res
+	def load_translateModels(): # for all the selected output languages, make sure a translation model is configured. models are only loaded once theyre needed
+		for lang in cfg.outLang:
+			if not Translate.translateModels.has(cfg.inLang, lang): G.showErr(reason="No model with translation direction: " + cfg.inLang + "->" + lang + " configured in cfg.translateModels (directly, or through cfg.pivotLanguage)")
 
 # DATA TYPES =======================================
 
@@ -290,57 +304,52 @@ class Subtitle:
 
 	def __str__(self): return (self.number + "\n" + self.timeRange + "\n" + self.text + "\n")
 
-# MAIN =============================================
-
-# discover files
-fileList = SimpleNamespace(**{})
-fileList.input = G.listFiles(cfg.inPath)
-fileList.input_srt = [f for f in fileList.input if G.extension(f) == ".srt"]
-print("Found " + str(len(fileList.input_srt)) + " .srt file(s).")
+class SrtError(ValueError): # raised by _readSubtitles when a .srt file is malformed
+	pass
 
-# initialize translator
-Translate.load_translateModels()
-
-def _translateSubtitles(filename):
-	subs_original = [] # list of untranslated subtitles
-	subs_translated = [] # list of translated subtitles
-
-	# open and read the file {
-	try:
-		print("Opening " + filename + " with utf-8 encoding...", end="")
-		file_read = io.open(cfg.inPath + filename, mode="r", encoding="utf-8")
-		lines = file_read.readlines() # array of strings, each representing a line, and ending with "\n"
-		print(" success")
-
-	except Exception as e:
-		print(" fail")
-
-		try:
-			print("Opening " + filename + " with utf-16 encoding...", end="")
-			file_read = io.open(cfg.inPath + filename, mode="r", encoding="utf-16")
-			lines = file_read.readlines()
-			print(" success")
-
-		except Exception as e_1:
-			print(" fail")
-			print("Exiting..."); raise SystemExit
-
-	#if cfg.testingMode: print("\n" + str(lines))
-	# }
+# MAIN =============================================
 
+# Opens a .srt file for reading. Returns a file object (lines are decoded as they are read)
+# the encoding is worked out from the start of the file (see textEncoding.py), which is peeked at in the read buffer, so the file is still only read once. Raises a UnicodeError if no encoding fits
+def _openSubtitles(filename):
+	path = cfg.inPath + filename
+	file_binary = io.open(path, mode="rb", buffering=max(cfg.detectBytes, io.DEFAULT_BUFFER_SIZE))
+	prefix = file_binary.peek(cfg.detectBytes)[:cfg.detectBytes]
+	encoding = detectEncoding(prefix, cfg.encodings, len(prefix) >= os.path.getsize(path))
+	if encoding is None:
+		file_binary.close()
+		raise UnicodeError("couldnt work out the encoding (tried: " + ", ".join(cfg.encodings) + ")")
+
+	print("Opening " + filename + " with " + encoding + " encoding")
+	return io.TextIOWrapper(file_binary, encoding=encoding, newline=None)
+
+# Records a .srt file which couldnt be read, so that the rest of the files can still be translated
+def _skip(filename, reason):
+	print("Skipping " + filename + ": " + reason)
+	skipped.append((filename, reason))
+
+# Same as _skip, for a file whose start fit 'encoding', but a later part doesnt
+def _skipUndecodable(filename, encoding, e):
+	_skip(filename, "not valid " + encoding + " past the start of the file (" + str(e) + "). Try a larger cfg.detectBytes, or removing " + encoding + " from cfg.encodings")
+
+def _reportSkipped():
+	if len(skipped) == 0: return
+	print(str(len(skipped)) + " .srt file(s) skipped:")
+	for filename, reason in skipped: print("- " + filename + ": " + reason)
+
+# Generator which reads subtitles from an iterable of lines (such as an open file), yielding each Subtitle as soon as it is complete. Raises an SrtError if the lines arent a valid .srt file
+def _readSubtitles(lines):
 	# Expected syntax for .srt files:
 	# 2
 	# 00:00:34,333 --> 00:00:39,750
 	# A long time ago, it is said,
 	# a monster came here.
 
-	print()
-
-	# load all subs {
 	hold = [None, None, None] # temporary hold for a subtitle. [0] is for a subititles' index number, [1] is for its time range, and [2] is for its text.
 
 	for l, line in enumerate(lines):
-		line = line.replace("\n", "") # remove the new-line character which is at the end of every line
+		if line.startswith("\x1a"): break # Ctrl-Z, which marks the end of DOS text files
+		line = line.replace("\n", "").rstrip("\x1a") # remove the new-line character which is at the end of every line
 		if cfg.verbosity >= 5: print(f'Line {l}: ' + G.wrap(line, "\""))
 
 		# check if the line is empty. this can mark the end of a subtitle, or can be at the beginning or end of a file.
@@ -352,7 +361,7 @@ def _translateSubtitles(filename):
 				print("Unexpected situation: a new-line was encountered, while the subtitle is incomplete. Occurred when processing line " + str(l+1) + " in the .srt file. Continuing...")
 
 			else: # this is the expected situation; a new line marks the end of the subtitle
-				subs_original.append(Subtitle(hold[0], hold[1], hold[2])) # load the hold into a new subtitle
+				yield Subtitle(hold[0], hold[1], hold[2]) # load the hold into a new subtitle
 				hold = [None, None, None] # empty the hold
 
 		elif line.isnumeric(): # if the line only contains a number. this represents the index of the subtitle (subtitle #), and marks the beginning of a subtitle.
@@ -361,8 +370,7 @@ def _translateSubtitles(filename):
 					print("Uncommon situation: it appears that a subtitles' text happens to just be a number. Encountered on line "  + str(l+1) + " in the .srt file. Continuing...")
 
 				else:
-					print("Error: a purely numerical line was encountered on line "  + str(l+1) + " in the .srt file (no, it doesn't appear to be the subtitle text by coincidence). Exiting...")
-					raise SystemExit
+					raise SrtError("a purely numerical line was encountered on line "  + str(l+1) + " in the .srt file (no, it doesn't appear to be the subtitle text by coincidence)")
 
 			else:
 				hold[0] = line
@@ -372,8 +380,7 @@ def _translateSubtitles(filename):
 				hold[1] = line
 
 			else:
-				print("Error: a time-range was encountered where it wasn't expected, on line "  + str(l+1) + " in the .srt file. Exiting...")
-				raise SystemExit
+				raise SrtError("a time-range was encountered where it wasn't expected, on line "  + str(l+1) + " in the .srt file")
 
 		else: # it is the subtitle text
 			if [v != None for v in hold] == [True, True, False]: # => first/only line of subtitle text
@@ -383,45 +390,305 @@ def _translateSubtitles(filename):
 				hold[2] += (" " + line)
 
 			else:
-				print("Error: subtitle text was encountered where it wasn't expected, on line "  + str(l+1) + " in the .srt file. Exiting...")
-				raise SystemExit
+				raise SrtError("subtitle text was encountered where it wasn't expected, on line "  + str(l+1) + " in the .srt file")
 
-	if all([v != None for v in hold]): subs_original.append(Subtitle(hold[0], hold[1], hold[2]))
+	if all([v != None for v in hold]): yield Subtitle(hold[0], hold[1], hold[2])
 	elif any([v != None for v in hold]):
-		print("The last subtitle is incomplete. Exiting...")
-		raise SystemExit
-
-	if cfg.verbosity >= 5:
-		for x in subs_original: print(x)
-	# }
+		raise SrtError("the last subtitle is incomplete")
+
+# Generator which takes subtitles from 'subs' cfg.windowSize at a time, and yields the translated subtitles (in the same order)
+# subtitles found in the journal (optional) are not translated again, and newly translated subtitles are recorded in it
+# None is yielded after each window, to mark that the window is complete (see _writeSubtitles)
+def _translateSubtitleStream(subs, sourceLang, targetLang, journal=None):
+	for start, window in _subtitleWindows(subs):
+		yield from _translateWindow(window, start, sourceLang, targetLang, journal)
+		yield None
+
+# Generator which groups the subtitles from 'subs' into windows of about cfg.windowSize subtitles. Yields (index of the window's first subtitle, list of subtitles)
+def _subtitleWindows(subs):
+	window = []
+	start = 0 # index of the first subtitle in the window
+	for sub in subs:
+		if cfg.verbosity >= 5: print(sub)
+		window.append(sub)
+		if len(window) >= cfg.windowSize:
+			cut = len(window)
+			if cfg.mergeSentences: # an unfinished sentence at the end of the window is kept for the next window, so that it isnt split in two
+				while (cut > len(window) - cfg.maxSentenceCues) and (cut > 1) and not _endsSentence(window[cut-1].text): cut -= 1
+				if not _endsSentence(window[cut-1].text): cut = len(window) # no sentence end found nearby
+			yield start, window[:cut]
+			start += cut
+			window = window[cut:]
+	if len(window) > 0: yield start, window
+
+# Whether or not a subtitle's text ends a sentence (subtitles which dont are merged with the next one, with cfg.mergeSentences)
+def _endsSentence(text):
+	text = text.rstrip()
+	return (text == "") or (text[-1] in ".!?…♪:;\"')]>»。！？")
+
+# Returns how long a subtitle is on screen, in seconds, from its time range (ex: "00:00:34,333 --> 00:00:39,750"). Returns None if the time range cant be read
+def _cueDuration(timeRange):
+	try:
+		times = []
+		for v in timeRange.split("-->"):
+			h, m, s = v.strip().split(" ")[0].replace(".", ",").split(":")
+			times.append(int(h)*3600 + int(m)*60 + float(s.replace(",", ".")))
+		return max(0.0, times[1] - times[0])
+	except Exception: return None
+
+# Groups the indexes in 'todo' (indexes of subtitles in 'window' which need translating) into sentences. Returns a list of lists of consecutive indexes
+	# a group ends when a subtitle ends a sentence, when the next subtitle starts a new line of dialogue ("- ..."), or after cfg.maxSentenceCues subtitles
+	# subtitles which dont need translating (numbers, symbols..) are never merged
+def _groupSentences(window, todo):
+	groups = []
+	for i in todo:
+		if (
+			(len(groups) > 0) and (groups[-1][-1] == i-1) # follows the previous group
+			and (len(groups[-1]) < cfg.maxSentenceCues)
+			and not _endsSentence(window[i-1].text)
+			and not window[i].text.lstrip().startswith("-")
+			and (Translate.planText(window[i].text, counted=False)[0] != "done") and (Translate.planText(window[i-1].text, counted=False)[0] != "done")
+		):
+			groups[-1].append(i)
+		else: groups.append([i])
+	return groups
+
+# Splits a translated sentence over the subtitles it came from, in proportion to 'weights' (one for each subtitle). Splits between words (or between characters, for languages written without spaces)
+# returns a list of strings (one for each subtitle), or None if the translation is too short to give every subtitle some text
+def _splitTranslation(text, weights):
+	spaced = " " in text.strip()
+	tokens = text.split() if spaced else list(text.strip())
+	if len(tokens) < len(weights): return None
+	if sum(weights) <= 0: weights = [1] * len(weights)
+
+	cumulative = [0] # amount of characters before each token
+	for token in tokens: cumulative.append(cumulative[-1] + len(token))
+
+	cuts = [0] # index of the first token of each part
+	weight = 0
+	for k in range(len(weights) - 1):
+		weight += weights[k]
+		goal = cumulative[-1] * weight / sum(weights)
+		options = range(cuts[-1] + 1, len(tokens) - (len(weights) - 2 - k)) # every part keeps at least one token
+		cuts.append(min(options, key=lambda c: abs(cumulative[c] - goal)))
+	cuts.append(len(tokens))
+
+	return [(" " if spaced else "").join(tokens[cuts[k]:cuts[k+1]]) for k in range(len(weights))]
+
+def _translateTexts(texts, sourceLang, targetLang):
+	if cfg.batchTranslation: return Translate.translateTexts_robust(texts, sourceLang, targetLang)
+	else: return [Translate.translateText_robust(v, sourceLang, targetLang) for v in texts]
+
+def _translateWindow(window, start, sourceLang, targetLang, journal=None):
+	translated = [(journal.lookup(start+i, sub.text) if journal is not None else None) for i, sub in enumerate(window)]
+	todo = [i for i in range(len(window)) if translated[i] is None] # subtitles which werent translated by a previous run
+
+	groups = _groupSentences(window, todo) if cfg.mergeSentences else [[i] for i in todo]
+	new = _translateTexts([" ".join([window[i].text for i in g]) for g in groups], sourceLang, targetLang)
+
+	retry = [] # subtitles of merged sentences whose translation couldnt be split. theyre translated individually instead
+	for g, text in zip(groups, new):
+		if len(g) == 1:
+			translated[g[0]] = text
+			continue
+
+		weights = [len(window[i].text) for i in g]
+		if cfg.splitBy == "duration":
+			durations = [_cueDuration(window[i].timeRange) for i in g]
+			if None not in durations: weights = durations
+		parts = _splitTranslation(text, weights)
+		if parts is None: retry += g
+		else:
+			for i, part in zip(g, parts): translated[i] = part
+	if len(retry) > 0:
+		for i, text in zip(retry, _translateTexts([window[i].text for i in retry], sourceLang, targetLang)): translated[i] = text
+
+	for i in todo:
+		if journal is not None: journal.record(start+i, window[i].text, translated[i])
+	if journal is not None: journal.flush()
+
+	return [Subtitle(sub.number, sub.timeRange, translated[i]) for i, sub in enumerate(window)]
+
+# Writes each subtitle from 'subs' to an open file as soon as it is produced. Returns the amount of subtitles written
+# the file is flushed whenever 'subs' yields None (at the end of each window, see _translateSubtitleStream), so that it matches what the journal has recorded
+def _writeSubtitles(subs, file_write):
+	amt = 0
+	for sub in subs:
+		if sub is None: # the whole window has been written
+			with stats.time("srtWrite"): file_write.flush()
+			print("Translating subtitles... " + str(amt) + " done\r", end="")
+			continue
+		if cfg.testingMode: print(sub)
+
+		with stats.time("srtWrite", 1):
+			if amt > 0: file_write.write("\n\n") # subtitles are separated by an empty line (there is no empty line after the last one)
+			file_write.write(sub.number + "\n" + sub.timeRange + "\n" + sub.text)
+		amt += 1
+	return amt
+
+# Returns the paths of the translated file, and of its journal
+def _outputPaths(filename):
+	return cfg.outPath + G.basename(filename) + " -" + cfg.outLang[0] + G.extension(filename), cfg.interPath + G.basename(filename) + " -" + cfg.outLang[0] + ".journal"
+
+# Reads, translates and writes a .srt file as a stream; only one window of subtitles is held in memory at a time, and translated subtitles reach the output file as they are produced
+def _translateSubtitles(filename):
+	path_out, path_journal = _outputPaths(filename)
 
-	# translate each subtitle {
-	print("Translating subtitles... \r", end="")
-	for i, sub in enumerate(subs_original):
-		subs_translated.append(Subtitle(sub.number, sub.timeRange, Translate.translateText_robust(sub.text, cfg.inLang, cfg.outLang[0])))
+	if cfg.resume and os.path.exists(path_out) and not os.path.exists(path_journal): # the output file was completed by a previous run
+		print("Skipping " + filename + " (already translated)")
+		return
 
-		# if ((i % (len(subs_original)/10)) == 0) or ((i % (len(subs_original)/10)) < ((i-1) % (len(subs_original)/10))):
-		# 	print(".", end="")
-		print("Translating subtitles... " + str((i+1) / len(subs_original)*100) + "% complete\r", end=""),
+	start = time.perf_counter()
+	try:
+		with stats.time("open", 1): file_read = _openSubtitles(filename)
+	except (OSError, UnicodeError) as e: return _skip(filename, str(e))
+	journal = Journal(path_journal, resume=True) if cfg.resume else None
+	if (journal is not None) and (len(journal.entries) > 0): print("Resuming from a previous run (" + str(len(journal.entries)) + " subtitle(s) already translated)")
 	print()
 
-	if cfg.testingMode:
-		for x in subs_translated: print(x)
-	# }
-
-	# write results into a new .srt file {
-	print("Writing results to new file...", end="")
-	with io.open(cfg.outPath + G.basename(filename) + " -" + cfg.outLang[0] + G.extension(filename), mode="w", encoding="utf-8") as file_translate: # output will be in utf-8 no matter the input .srt encoding. i did this because google translate api outputs in utf-8.
-		for i, sub in enumerate(subs_translated):
-			if i == len(subs_translated)-1:
-				file_translate.write(sub.number + "\n" + sub.timeRange + "\n" + sub.text)
-			else: file_translate.write(str(sub) + "\n")
-	print(" done")
-	# }
-
-for srtFile in fileList.input_srt: _translateSubtitles(srtFile)
-
-print("End of script.")
+	print("Translating subtitles... \r", end="")
+	try:
+		with file_read, io.open(path_out, mode="w", encoding="utf-8") as file_translate: # output will be in utf-8 no matter the input .srt encoding. i did this because google translate api outputs in utf-8.
+			subs = stats.timedIter("srtParse", _readSubtitles(stats.timedIter("read", file_read))) # reading (and decoding) lines, and parsing them into subtitles, are timed separately
+			amt = _writeSubtitles(_translateSubtitleStream(subs, cfg.inLang, cfg.outLang[0], journal), file_translate)
+	except (UnicodeDecodeError, SrtError) as e: # the start of the file fit the encoding, but a later part doesnt, or the file is malformed
+		print()
+		os.remove(path_out) # the subtitles translated so far stay in the journal
+		if journal is not None: journal.close()
+		if isinstance(e, UnicodeDecodeError): return _skipUndecodable(filename, file_read.encoding, e)
+		return _skip(filename, str(e))
+	print("Translating subtitles... " + str(amt) + " done")
+	print("Results written to new file")
+
+	if journal is not None: journal.finish() # the output file is complete
+	stats.fileDone(filename, time.perf_counter() - start, amt)
+
+# Translates several .srt files at the same time (cfg.concurrentFiles at a time). Batches from different files are merged into shared model calls by a BatchScheduler
+def _translateSubtitles_concurrent(filenames):
+	from concurrent.futures import ThreadPoolExecutor
+	Translate.scheduler = BatchScheduler(Translate.decodeGuard.translate, cfg.batchSize, cfg.batchTokens, cfg.batchWait)
+	try:
+		with ThreadPoolExecutor(max_workers=cfg.concurrentFiles) as pool:
+			for future in [pool.submit(_translateSubtitles, v) for v in filenames]: future.result()
+	finally:
+		Translate.scheduler.close()
+		print(Translate.scheduler.report())
+		Translate.scheduler = None # later translations call the model directly
+
+# Reads a .srt file the same way _translateSubtitles does, but only returns how much of it would be sent to the translator (for cfg.dryRun), or None if the file is skipped
+# returns a SimpleNamespace(subtitles, resumed, segments, texts, tokens). subtitles found in the journal of an interrupted run arent counted in 'segments', 'texts' and 'tokens'
+def _estimateSubtitles(filename):
+	path_out, path_journal = _outputPaths(filename)
+	if cfg.resume and os.path.exists(path_out) and not os.path.exists(path_journal):
+		print("Skipping " + filename + " (already translated)")
+		return None
+
+	try: file_read = _openSubtitles(filename)
+	except (OSError, UnicodeError) as e: return _skip(filename, str(e))
+	journal = Journal(path_journal, resume=True, readOnly=True) if cfg.resume else None
+
+	res = SimpleNamespace(subtitles=0, resumed=0, segments=0, texts=0, tokens=0)
+	try:
+		with file_read:
+			for start, window in _subtitleWindows(_readSubtitles(file_read)):
+				todo = [i for i, sub in enumerate(window) if (journal is None) or (journal.lookup(start+i, sub.text) is None)]
+				groups = _groupSentences(window, todo) if cfg.mergeSentences else [[i] for i in todo]
+				inputs = [v for g in groups for v in Translate.planInputs(Translate.planText(" ".join([window[i].text for i in g]), counted=False))] # text which the pre-filters let through to the translator
+				res.subtitles += len(window)
+				res.segments += len(groups)
+				res.texts += len(inputs)
+				res.tokens += sum([countTokens(v) for v in inputs])
+	except UnicodeDecodeError as e: return _skipUndecodable(filename, file_read.encoding, e)
+	except SrtError as e: return _skip(filename, str(e))
+	if journal is not None: res.resumed = journal.resumed
+
+	print(filename + ": " + str(res.subtitles) + " subtitle(s)" + (" (" + str(res.resumed) + " already translated by a previous run)" if res.resumed > 0 else "")
+		+ ", " + str(res.segments) + " segment(s), " + str(res.texts) + " text(s) for the translator, ~" + str(res.tokens) + " token(s)")
+	return res
+
+# Reports how much there is to translate in the .srt files, without loading any translation model (cfg.dryRun)
+def _dryRun(filenames):
+	total = SimpleNamespace(files=0, subtitles=0, resumed=0, segments=0, texts=0, tokens=0)
+	for filename in filenames:
+		res = _estimateSubtitles(filename)
+		if res is None: continue
+		total.files += 1
+		for k, v in vars(res).items(): setattr(total, k, getattr(total, k) + v)
+
+	print("Dry run: " + str(total.files) + " .srt file(s) to translate, " + str(total.subtitles) + " subtitle(s) (" + str(total.resumed) + " already translated), "
+		+ str(total.segments) + " segment(s), " + str(total.texts) + " text(s) for the translator, ~" + str(total.tokens) + " token(s) (before the translation memory and de-duplication)")
+	if total.texts > 0:
+		models = Translate.translateModels
+		pivotLang = models.pivot(cfg.inLang, cfg.outLang[0])
+		hops = [(cfg.inLang, cfg.outLang[0])] if pivotLang is None else [(cfg.inLang, pivotLang), (pivotLang, cfg.outLang[0])]
+		print("Model(s) needed: " + ", ".join([s + "->" + t + " (" + models.path(s, t) + ", " + models.backends[models.path(s, t)] + ")" for s, t in hops]))
+	_reportSkipped()
+
+# Updates cfg with the options given on the command line
+def parseArgs(argv=None):
+	parser = argparse.ArgumentParser(description="Translates the .srt files in cfg.inPath. Options given here override the config at the top of this file")
+	parser.add_argument("--threads", type=int, help="CPU threads the translation model uses per batch (cfg.threads)")
+	parser.add_argument("--inter-op-threads", type=int, help="batches the model may run side by side (cfg.interOpThreads)")
+	parser.add_argument("--pin-cores", action="store_true", default=None, help="pin this script to its own set of CPU cores (cfg.pinCores)")
+	parser.add_argument("--no-numa", action="store_true", help="when pinning, allow cores from several NUMA nodes (cfg.numaAware)")
+	parser.add_argument("--instance", help="i/n: this is copy i (from 0) of n copies running side by side (cfg.instance)")
+	parser.add_argument("--concurrent-files", type=int, help=".srt files translated at the same time (cfg.concurrentFiles)")
+	parser.add_argument("--dry-run", action="store_true", help="only report how much there is to translate, without loading any model (cfg.dryRun)")
+	args = parser.parse_args(argv)
+
+	if args.threads is not None: cfg.threads = args.threads
+	if args.inter_op_threads is not None: cfg.interOpThreads = args.inter_op_threads
+	if args.pin_cores is not None: cfg.pinCores = True
+	if args.no_numa: cfg.numaAware = False
+	if args.instance is not None:
+		try: cfg.instance = list(cpuAffinity.parseInstance(args.instance))
+		except ValueError as e: parser.error(str(e))
+	if args.concurrent_files is not None: cfg.concurrentFiles = args.concurrent_files
+	if args.dry_run: cfg.dryRun = True
+	return args
+
+# Translates the .srt files in cfg.inPath. Optional parameter 'argv' is a list of command line options (default: the ones this script was run with)
+# heavy libraries (torch, transformers..) are only imported when a model is first needed, so runs with nothing to translate (or cfg.dryRun) finish quickly
+def main(argv=None):
+	parseArgs(argv)
+	print("Config options:", str(vars(cfg)))
+	cpuAffinity.applyThreads(cfg.threads, cfg.interOpThreads, cpuAffinity.planCores(1, cfg.threads, cfg.numaAware, *cfg.instance)[0] if cfg.pinCores else None)
+	print(cpuAffinity.report())
+
+	# discover files
+	fileList = SimpleNamespace(**{})
+	fileList.input = G.listFiles(cfg.inPath)
+	fileList.input_srt = [f for f in fileList.input if G.extension(f) == ".srt"]
+	print("Found " + str(len(fileList.input_srt)) + " .srt file(s).")
+
+	# initialize translator
+	Translate.load_translateModels()
+	if cfg.dryRun: return _dryRun(fileList.input_srt)
+	if cfg.translationMemory and (len(fileList.input_srt) > 0): Translate.translationMemory = TranslationMemory(cfg.translationMemoryPath, cfg.translationMemorySize)
+
+	if cfg.concurrentFiles > 1: _translateSubtitles_concurrent(fileList.input_srt)
+	else:
+		for srtFile in fileList.input_srt: _translateSubtitles(srtFile)
+
+	print(Translate.translateModels.report())
+	if Translate.translationMemory is not None:
+		print(Translate.translationMemory.report())
+		Translate.translationMemory.close()
+	print(Translate.textFilter.report())
+	if cfg.masking: print(Translate.masker.report())
+	print(Translate.decodeGuard.report())
+	if Translate.pivotCache.misses > 0: print("Pivot translations: " + str(Translate.pivotCache.hits) + " of " + str(Translate.pivotCache.hits + Translate.pivotCache.misses) + " intermediate translation(s) reused from the cache")
+	_reportSkipped()
+
+	print(stats.table())
+	if cfg.statsReport != "":
+		stats.write(cfg.statsReport)
+		print("Timing report written to " + cfg.statsReport)
+
+	print("End of script.")
+
+if __name__ == "__main__":
+	main()
 
 # SOURCES ==========================================
 	
@@ -7,24 +7,23 @@ Requirements:
 	Python: https://www.python.org/downloads/
 	3 folders (input, intermediary, and output) (in the same folder as this python file) (the intermediary and output folders should be empty)
 	Install python-docx library: terminal > "pip install python-docx"
-	Install the docx2pdf module: terminal > "pip install docx2pdf"
+	To convert to PDF (cfg.convertToPDF), either: Install the docx2pdf module: terminal > "pip install docx2pdf" (needs Microsoft Word), or install LibreOffice (see cfg.pdfConverter)
 	Install the easynmt module: terminal > "pip install easynmt" (this might be difficult to get working)
+	translationMemory.py, translationPipeline.py, translationJournal.py, modelRegistry.py, runStats.py, wordXml.py, pdfConverter.py, textFilter.py, decodeGuard.py, batchScheduler.py, inferenceBackend.py and cpuAffinity.py (in the same folder as this python file)
 	Pre-trained models for 'opus-mt' (placed in the same folder as this python file), which can be downloaded from https://huggingface.co/models?sort=downloads&search=opus-mt
-		The models must also be loaded in the code (see the load_translateModels() function)
+		The models must also be configured in the code (see cfg.translationModels)
 
 Known issues:
-	All text within a paragraph is styled the same way (font, colour, bold, italics) (this is because, while differently formatted text is segmented into separate runs, the text will be rejoined prior to translation to increase translation accuracy. After translation, its really hard to know which of the translated text deserves separate formatting.)
+	All text within a paragraph (including paragraphs in table cells) is styled the same way (font, colour, bold, italics) (this is because, while differently formatted text is segmented into separate runs, the text will be rejoined prior to translation to increase translation accuracy. After translation, its really hard to know which of the translated text deserves separate formatting.)
 	Elements with a static position on page (after conversion to word) will appear in the wrong place (because they dont appear in any 'run.text')
-	Translation may not use all CPU cores (I plan to multi-thread this step, so that many translations can be calculated simultaneously)
-	Formatting of text within table cells might be fucked up
-	Text inside cells inside tables inside other tables are not translated
+	Translation may not use all CPU cores (set cfg.workers to translate many documents simultaneously)
+	With cfg.docEngine = "python-docx", only the body and top level tables are translated (nested tables, headers, footers, footnotes, endnotes and text boxes are only translated by the "xml" engine)
 
 Limitations:
-	Only one *source* language can be set (multiple target languages can be set)
+	Only one *source* language can be set (multiple target languages can be set). Language pairs without a direct model are translated through cfg.pivotLanguage
 	Rasterized text (text in pictures, videos) isn't translated
 
 Future Steps:
-	Multi-thread translation
 	Config options verification
 	Put the model configs in the cfg namespace
 	Translating a paragraph uses the formatting of a selected run based on how much text it has
@@ -37,15 +36,22 @@ try:
 	import io
 	import shutil # copying files
 	import sys
+	import time
 	from types import SimpleNamespace
 	import pprint
-
-	from contextlib import contextmanager, redirect_stderr, redirect_stdout
-	from os import devnull
-
-	from easynmt import EasyNMT, models # NMT translator
-	import docx # python-docx module
-	from docx2pdf import convert # to convert word to pdf
+	import argparse
+
+	import cpuAffinity # CPU thread counts and core pinning
+	from modelRegistry import ModelOrganiser # loads NMT translation models when theyre needed
+	from pdfConverter import PdfConverter # to convert word to pdf (in the background)
+	from translationMemory import TranslationMemory, LruCache # on-disk cache of previous translations
+	from translationJournal import Journal # checkpoints, to resume interrupted runs
+	from runStats import stats, countTokens # per-stage timing
+	from textFilter import TextFilter, Masker # keeps text which doesnt need translating away from the model
+	from decodeGuard import DecodeGuard # keeps the model from generating runaway output
+	from translationPipeline import Pipeline # filters, translation memory, masking, pivoting and batching of the text sent to the model
+	from batchScheduler import BatchScheduler # merges batches from documents translated at the same time
+	# python-docx and wordXml.py (lxml) are imported when the first document is loaded (see Translate.loadDoc), since importing them takes a while
 
 	print("Modules imported")
 except Exception as e: G.showErr("Error when importing modules", e)
@@ -62,18 +68,63 @@ cfg = SimpleNamespace(**{
 	"outLanguage": ["ar"], # list of languages for translated documents (abbreviated form). ex: ["fr", "de", "it", "es", "ar"]
 
 	"convertToPDF": True, # whether or not to: afterwards, convert all translated word documents to PDF
+	"pdfConverter": "docx2pdf", # program used to convert to PDF: "docx2pdf" (Microsoft Word) or "libreoffice" (headless LibreOffice, works on Linux). Conversions run in the background while the next document is translated
+	"pdfWorkers": 2, # max amount of documents converted at the same time (only for "libreoffice"; Word converts one document at a time)
+	"sofficePath": "soffice", # location of LibreOffice's 'soffice' program (for "libreoffice")
+	"docEngine": "xml", # how documents are read and written: "xml" (parses word/document.xml in a single pass; much faster on large documents) or "python-docx"
+	"multiTarget": True, # load and traverse each document only once, and translate it to every language in outLanguage from there
+	"resume": True, # keep a journal of translated text in interPath, so that an interrupted run continues where it stopped (and finished documents are skipped)
+	"prefetch": True, # load the next document and the next translation model in the background, while the current document is being translated
+	"workers": 1, # amount of processes translating documents at the same time. Each worker loads its own copy of the models it needs (1 = translate in this process)
+	"concurrentDocs": 1, # amount of documents translated at the same time by this process (when workers is 1). Above 1, batches from different documents are merged before being sent to the model (see batchScheduler.py), so that short documents still fill whole batches
+	"batchTokens": 2048, # max amount of tokens (whitespace separated words) in a merged batch (0 = no limit) (when concurrentDocs is above 1)
+	"batchWait": 0.05, # max amount of time (in seconds) a batch waits for batches from other documents to join it (when concurrentDocs is above 1)
+	"threadsPerWorker": 0, # amount of CPU threads used by each worker's translation models per batch (0 = let the backend decide, or one per pinned core). Keep workers*threadsPerWorker <= amount of CPU cores
+	"interOpThreads": 0, # amount of batches each worker's models may run side by side (0 = let the backend decide)
+	"pinCores": False, # pin each worker to its own set of CPU cores, so that workers (and copies of this script, see 'instance') dont fight over the same cores (see cpuAffinity.py)
+	"numaAware": True, # when pinning, keep each worker's cores on a single NUMA node
+	"instance": [0, 1], # when several copies of this script run side by side: [this copy's number (from 0), amount of copies]. Each copy's workers are pinned to its own share of the cores
+	"batchSize": 32, # max amount of paragraphs sent to the translation model at a time
+	"windowSize": 256, # amount of paragraphs translated between checkpoints (see cfg.resume)
+	"translationMemory": True, # remember translations on disk, so that repeated text (headers, footers, table labels, re-runs) doesnt need to be translated again
+	"translationMemoryPath": "translationMemory.sqlite3", # file in which translations are remembered (shared with translateSubtitles.py)
+	"translationMemorySize": 200000, # max amount of remembered translations. The least recently used ones are forgotten first
+	"passthroughPatterns": [ # text which fully matches any of these regular expressions is left as-is, instead of being translated
+		r"(https?://|www\.)\S+", # URLs
+		r"[\w.+-]+@[\w-]+(\.[\w-]+)+", # email addresses
+		r"[\d\s.,:;/%+()\-–]+", # numbers, dates, times, percentages..
+		r"[A-Z]{1,5}[-_]?\d[\w./-]*", # codes (ex: "ISO-9001", "A4", "SKU123-45")
+		],
+	"maxNewTokens": 512, # max amount of tokens the model may generate for one text
+	"maxOutputRatio": 3, # translations more than this many times longer (in characters) than their input are treated as garbage. The model isnt allowed to generate more tokens than that either
+	"stopEarly": True, # stop generating as soon as the model gets stuck repeating itself, instead of running until the token limit
+	"masking": True, # swap tags, URLs, codes, numbers.. for placeholders before translating, and put them back afterwards (shorter input for the model, and they cant be mangled)
+	"maskPatterns": [ # regular expressions of the spans which are masked
+		r"<[^<>]+>", # tags (ex: "<b>")
+		r"(https?://|www\.)\S+", # URLs
+		r"[\w.+-]+@[\w-]+(\.[\w-]+)+", # email addresses
+		r"[A-Z]{1,5}[-_]?\d[\w./-]*", # codes (ex: "ISO-9001", "A4", "SKU123-45")
+		r"(?<![\w.])\d+([.,:]\d+)*(?!\w|[.,:]\d)", # numbers (not part of a word, ex: "MP3", "4K")
+		],
+	"dryRun": False, # only load the documents, and report how much there is to translate (segments, estimated tokens), without loading any translation model or writing any file
+	"statsReport": "", # file to write a timing report to at the end of the run: JSON if it ends with ".json", otherwise Prometheus textfile format ("" = only print the summary table)
 	"verbosity": 5,
 	"testingMode": True, # no user input required during runtime, and no error catching
 
 	"translationModels": {
 		# translation model locations, and their translation direction in the form: <FOLDER_NAME>: {"inLang": <INPUT_LANGUAGE_ABBREV>, "outLang": <OUTPUT_LANGUAGE_ABBREV>}
+		# an optional "backend" picks how the model is run: "torch" (default), "int8" (quantized, faster on CPU), "ctranslate2" or "onnx" (converted once, and cached next to the model's folder). See inferenceBackend.py
+		# ex: "opus-mt-en-fr\\": {"sourceLang": "en", "targetLang": "fr", "backend": "ctranslate2"},
 		"opus-mt-en-fr\\": {"sourceLang": "en", "targetLang": "fr"},
 		"opus-mt-en-de\\": {"sourceLang": "en", "targetLang": "de"},
 		"opus-mt-en-it\\": {"sourceLang": "en", "targetLang": "it"},
 		"opus-mt-en-es\\": {"sourceLang": "en", "targetLang": "es"},
 		"opus-mt-en-ar\\": {"sourceLang": "en", "targetLang": "ar"},
 		"opus-mt-en-vi\\": {"sourceLang": "en", "targetLang": "vi"},
-		}
+		},
+	"modelMemoryBudget": 0, # max amount of memory (MB) used by loaded translation models. When exceeded, the least recently used model is unloaded (0 = no limit)
+	"pivotLanguage": "en", # language pairs without a direct model are translated through this language (ex: de->en->fr), if models for both hops are configured ("" = only use direct models). The intermediate text is only translated once, no matter how many target languages there are
+	"pivotCacheSize": 100000, # max amount of intermediate (pivot language) translations kept in memory
 	})
 
 # DATA ===========================================
@@ -234,55 +285,23 @@ class G:
 		input("Press <ENTER> to exit")
 		raise SystemExit
 
-class Translate:
-	def translateText(text, sourceLang, targetLang):
-		return translateModels.get(sourceLang, targetLang).translate(text, source_lang=sourceLang, target_lang=targetLang, max_new_tokens=512)
-
-	def translateText_robust(text, sourceLang, targetLang):
-		if cfg.verbosity >= 4: print("Translating text: " + G.wrap(text, "\""))
-
-		#if "\n" in text: return Translate.translateText_robust(text.replace("\n", " "), sourceLang, targetLang)
-
-		# some characters / combinations of characters will make the translater return some wacky stuff.
-		# known cases:
-			# strings containing only numbers (and perhaps spaces and periods)
-			# the '≈' symbol on its own
-			# "NUMBER. (SOME_TEXT)" this will cause the translator to go on about the european council and some other bullshit
-			# greek letters, when translated alone, make the translator output nonsense
-			# the letter 'r' (by itself) . It makes the translator spit out some garbage. Im going to pre-emptively avoid translating any single letters.
-			# "TEXT!)." the translator returns the text, exclamation mark, and closed parenthesis followed by a bunch of periods
-		# {
-		if (text is None) or (all([(v == " " or v == "\t") for v in text])): res = ""
-		elif all([(v.isnumeric() | (v==" ") | (v=="\t") | (v==".")) for v in text]): res = text # if every char in the string is either a number, a tab, a space, or a period
-		elif text == "≈": res = text # if the string contains only '≈'
-
-		elif (len(text) > 2) and (text[0].isnumeric()) & (text[1] == "."):
-			if cfg.verbosity >= 5: print("Recursing")
-			res = text[0:2] + Translate.translateText_robust(text[2:], sourceLang, targetLang)
-				
-		elif (len(text) == 1): res = text
-		
-		elif (text.find("!).") != -1) and (all([(v == ".") for v in text[text.find("!).")+2:]])):
-			res = (Translate.translateText_robust(text[:text.find("!).")+2], sourceLang, targetLang) + str(text[text.find("!).")+2:]))
-		# }
-
-		else:
-			res = Translate.translateText(text, sourceLang, targetLang)
-			if cfg.verbosity >= 5: print("Clear")
-
-		if (
-			len(res) > 3*len(text)
-			or (".........." in res)
-			or ("----------" in res)
-		):
-			if cfg.verbosity >= 4: print("Translation looks like some garbage. Using original un-translated text..")
-			return text # if the translator bugs and returns a bunch of garbage, return the original untranslated text
-		else: return res
-
-	def translateDoc(filename, sourceLang, targetLang):
-		doc = docx.Document(cfg.inPath + filename) # Load the word document
-
-		amtParagraph = len(doc.paragraphs)
+class Translate(Pipeline): # the translation pipeline is in translationPipeline.py
+	options = cfg # class variable containing the config the pipeline uses
+	translateModels = None # class variable containing a ModelOrganiser() (one per process, models are loaded when first needed)
+	translationMemory = None # class variable containing a TranslationMemory() (one per process, or None if disabled)
+	textFilter = TextFilter(cfg.passthroughPatterns) # class variable containing a TextFilter()
+	masker = Masker(cfg.maskPatterns) # class variable containing a Masker()
+	decodeGuard = DecodeGuard(cfg.maxNewTokens, cfg.maxOutputRatio, cfg.stopEarly) # class variable containing a DecodeGuard()
+	pivotCache = LruCache(cfg.pivotCacheSize) # class variable containing the intermediate text of pivot translations: (sourceLang, pivotLang, text) -> translation
+	scheduler = None # class variable containing a BatchScheduler() which model calls go through, or None to call the model directly (with cfg.concurrentDocs, or set by translateServer.py)
+
+	# A piece of a document which is translated as a whole
+		# runs: list of the runs whose text makes up the segment
+		# target: index of the run (in 'runs') which receives the translated text. The text of every other run is erased
+		# text: the untranslated text
+		# translate: whether or not the text should be translated (superscript and subscript text is left as-is, but is still moved into the target run)
+	def collectSegments(doc):
+		segments = []
 
 		''' if cfg.verbosity >= 4:
 			print("\t# inline pictures:", len(doc.inline_shapes))
@@ -292,10 +311,15 @@ class Translate:
 			runList = runList[:len(runList)-2]
 			print("\t# paragraphs:", str(len(doc.paragraphs)))
 			print("\t# runs in each paragraph:", runList) '''
-		
-		# translate all paragraphs
-		for p in doc.paragraphs:
-			if (len([r.text for r in p.runs]) > 0) and any([r.text != "" for r in p.runs]): # if there are any runs in the paragraph, and if any of those run.texts contain characters
+
+		# all paragraphs (in the body, and in table cells)
+		# a cell which is merged with its neighbours is listed once for each of them by '_cells', so paragraphs which were already collected are skipped
+		seen = set()
+		for p in doc.paragraphs + [p for table in doc.tables for cell in table._cells for p in cell.paragraphs]:
+			if p._p in seen: continue
+			seen.add(p._p)
+			runs = p.runs
+			if (len([r.text for r in runs]) > 0) and any([r.text != "" for r in runs]): # if there are any runs in the paragraph, and if any of those run.texts contain characters
 
 				#if cfg.verbosity >= 5: print("Paragraph text: " + G.wrap(p.text, "\""))
 
@@ -305,55 +329,107 @@ class Translate:
 				# we will try to find the most appropriate run (within said paragraph) from which its format (font, italics, etc) is to be used, by: going through the runs until an alphabetical character is found
 					# this particularly addresses the case where a paragraph containing bullet points is to be translated; we want to use the format of the first word, and not the format of the bullet point (which is usually some default font like calibri)
 				# {
-				tempRunText = "".join([r.text for r in p.runs]) # join all of the texts into a single string
-				
-				for i in range(len(p.runs)): # iterate through runs
-					if any([v.isalpha() for v in p.runs[i].text]): # if run.text contains any alphabetical character
-						for j in range(len(p.runs)): p.runs[j].text = "" # erase text from all runs within the paragraph
-
-						if not(p.runs[i].font.superscript or p.runs[i].font.subscript): # dont translate superscript or subscript text
-							p.runs[i].text = Translate.translateText_robust(tempRunText, sourceLang, targetLang)
-						else:
-							p.runs[i].text = tempRunText
-
-						continue # exit loop
+				for i in range(len(runs)): # iterate through runs
+					if any([v.isalpha() for v in runs[i].text]): # if run.text contains any alphabetical character
+						text = "".join([r.text for r in runs]) # join all of the texts into a single string
+						segments.append(SimpleNamespace(
+							runs = runs,
+							target = i,
+							text = text.strip(), # the text sent to the translator (the model drops leading / trailing whitespace)
+							lead = text[:len(text)-len(text.lstrip())], # whitespace put back around the translation by applySegments
+							trail = text[len(text.rstrip()):],
+							translate = not(runs[i].font.superscript or runs[i].font.subscript), # dont translate superscript or subscript text
+						))
+						break
 				# }
 
-		if cfg.verbosity >= 5:
-			print("--TABLES--")
-			for i in range(len(doc.tables)):
-				for j in range(len(doc.tables[i]._cells)):
-					for k in range(len(doc.tables[i]._cells[j].paragraphs)):
-						for l in range(len(doc.tables[i]._cells[j].paragraphs[k].runs)):
-							print(" Table-" + str(i) + " Cell-" + str(j) + " Para-" + str(k) + " Run-" + str(l) + " " + G.wrap(doc.tables[i]._cells[j].paragraphs[k].runs[l].text, "\"") + " Superscript-" + str(doc.tables[i]._cells[j].paragraphs[k].runs[l].font.superscript))
-
+		return segments
 
-		# translate all tables
-		# to preserve text formatting, we navigate down to the 'runs' layer to edit the text
-		for i in range(len(doc.tables)):
-			for j in range(len(doc.tables[i]._cells)):
-				for k in range(len(doc.tables[i]._cells[j].paragraphs)):
-					for l in range(len(doc.tables[i]._cells[j].paragraphs[k].runs)):
-						tmp_run = doc.tables[i]._cells[j].paragraphs[k].runs[l]
+	# Writes translated text into the runs of each segment. 'translations' is a list with a string for each segment
+	def applySegments(segments, translations):
+		for seg, text in zip(segments, translations):
+			for r in seg.runs: r.text = "" # erase text from all runs within the segment
+			seg.runs[seg.target].text = seg.lead + text + seg.trail
 
-						if not(tmp_run.font.superscript or tmp_run.font.subscript): # dont translate superscript or subscripted text (its probably part of a math equation)
-							doc.tables[i]._cells[j].paragraphs[k].runs[l].text = Translate.translateText_robust(doc.tables[i]._cells[j].paragraphs[k].runs[l].text, sourceLang, targetLang) # replace text with translated text
-
-		# Save the document
-		filename_out = G.basename(filename) + " -" + targetLang + G.extension(filename)
-		doc.save(cfg.interPath + filename_out)
+	def translateDoc(filename, sourceLang, targetLang):
+		Translate.translateDoc_multi(filename, sourceLang, [targetLang])
+
+	# Loads a document and collects its segments (with either engine, see cfg.docEngine). Returns a SimpleNamespace(doc, segments, originals)
+	# the returned 'doc' has a save(path) method either way
+	# optional parameter 'folder' is the folder containing the document (default: cfg.inPath)
+	def loadDoc(filename, folder=None):
+		if folder is None: folder = cfg.inPath
+		if cfg.docEngine == "xml":
+			import wordXml # reads and writes document text straight from the .docx XML
+			with stats.time("docLoad", 1): doc = wordXml.Document(folder + filename)
+			with stats.time("docTraversal") as s:
+				segments = wordXml.collectSegments(doc)
+				s.items = len(segments)
+		else:
+			import docx # python-docx module
+			with stats.time("docLoad", 1): doc = docx.Document(folder + filename) # Load the word document
+			with stats.time("docTraversal") as s:
+				segments = Translate.collectSegments(doc)
+				s.items = len(segments)
+		originals = [[r.text for r in seg.runs] for seg in segments] # to restore the document between languages
+		return SimpleNamespace(doc=doc, segments=segments, originals=originals)
+
+	# Returns the translation of each segment (from loadDoc). Segments found in the journal (optional) are not translated again, and newly translated segments are recorded in it
+	def translateSegments(segments, sourceLang, targetLang, journal=None):
+		translations = [(journal.lookup(i, seg.text) if journal is not None else None) for i, seg in enumerate(segments)]
+
+		# identical segments (repeated headers and footers, table labels..) are only translated once per document
+		# the texts are sorted by length before being split into windows, so that each batch sent to the model contains texts of similar length
+		todo = {} # text -> list of indexes in 'segments' which contain it
+		for i, seg in enumerate(segments):
+			if translations[i] is None:
+				if seg.translate: todo.setdefault(seg.text, []).append(i)
+				else: translations[i] = seg.text
+		todo_texts = sorted(todo.keys(), key=len, reverse=True)
+
+		for w in range(0, len(todo_texts), cfg.windowSize):
+			window = todo_texts[w:w+cfg.windowSize]
+			for text, res in zip(window, Translate.translateTexts_robust(window, sourceLang, targetLang)):
+				for i in todo[text]:
+					translations[i] = res
+					if journal is not None: journal.record(i, text, res)
+			if journal is not None: journal.flush()
+		return translations
+
+	# Translates a document to every language in 'targetLangs'
+	# the document is only loaded and traversed once. Each translation is written into the same parsed document, saved, and then the original text is put back before the next language
+	# optional parameter 'loaded' is the result of loadDoc(filename), if the document was already loaded (prefetched)
+	def translateDoc_multi(filename, sourceLang, targetLangs, loaded=None):
+		if loaded is None: loaded = Translate.loadDoc(filename)
+		doc, segments, originals = loaded.doc, loaded.segments, loaded.originals
+
+		for j, targetLang in enumerate(targetLangs):
+			start = time.perf_counter()
+			if len(targetLangs) > 1: print("Translating to " + G.wrap(LANGUAGES[targetLang], "'") + "..")
+			if cfg.prefetch and (j+1 < len(targetLangs)): Translate.translateModels.prefetch(sourceLang, targetLangs[j+1]) # load the next language's model while this one is translating
+			filename_out = G.basename(filename) + " -" + targetLang + G.extension(filename)
+
+			# segments found in the journal were translated by a previous (interrupted) run
+			journal = Journal(cfg.interPath + G.basename(filename_out) + ".journal", resume=True) if cfg.resume else None
+			translations = Translate.translateSegments(segments, sourceLang, targetLang, journal)
+			if (journal is not None) and (journal.resumed > 0): print("Resumed " + str(journal.resumed) + " segment(s) from a previous run")
+
+			Translate.applySegments(segments, translations)
+
+			# Save the document
+			with stats.time("docSave", 1): doc.save(cfg.interPath + filename_out)
+			if journal is not None: journal.close() # the journal is deleted by finishDoc, once the document is in the output folder
+			stats.fileDone(filename_out, time.perf_counter() - start, len(segments))
+
+			# Restore the original text
+			for seg, texts in zip(segments, originals):
+				for r, text in zip(seg.runs, texts): r.text = text
 
 def update_fileList():
 	files.inPath = G.listFiles(cfg.inPath)
 	files.inPath_docx = [v for v in files.inPath if ((G.extension(v) == ".docx") and (v[0] != "~"))] # temporary files start with '~'
 	files.interPath = G.listFiles(cfg.interPath)
 
-@contextmanager
-def suppress_stdout_stderr(): # https://gist.github.com/vikjam/755930297430091d8d8df70ac89ea9e2
-	with open(devnull, 'w') as fnull:
-		with redirect_stderr(fnull) as err, redirect_stdout(fnull) as out:
-			yield (err, out)
-
 # DATA TYPES =======================================
 
 class Style():
@@ -384,26 +460,6 @@ class Style():
 
 	def apply(text, colour): return (getattr(Style(), colour.upper()) + text + Style.RESET)
 
-class ModelOrganiser:
-	def __init__(self):
-		self.repo = {}
-
-	def add(self, model, sourceLang, targetLang):
-		self.repo[sourceLang + "-" + targetLang] = model
-
-	def get(self, sourceLang, targetLang):
-		if (sourceLang + "-" + targetLang) not in self.repo: # if model is has not been loaded yet (its the first time translating to this language)
-			# search for a pre-trained model in 'cfg.translationModels' with the desired translation direction
-			for key in cfg.translationModels:
-				if cfg.translationModels[key]["sourceLang"] == sourceLang and cfg.translationModels[key]["targetLang"] == targetLang: # if its translation direction is a match
-					self.add(EasyNMT(translator=models.AutoModel(key)), sourceLang, targetLang)
-					print("Loaded model with translation direction: " + LANGUAGES[sourceLang] + "->" + LANGUAGES[targetLang] + " from: " + key)
-
-			if (sourceLang + "-" + targetLang) not in self.repo: # if desired model was not found in cfg.transationModels..
-				G.showErr(reason="No model with translation direction: " + sourceLang + "->" + targetLang + " configured.")
-		
-		return self.repo[sourceLang + "-" + targetLang]
-
 
 # MAIN =============================================
 
@@ -411,48 +467,310 @@ class ModelOrganiser:
 def dispConfig():
 	print("Config options:")
 	print("\n".join([("- " + Style.apply(v, "DARK_GRAY")) for v in G.printDict(vars(cfg), stripped=False, indentLevel=2).split("\n")]))
-dispConfig()
-
-# Initialize ModelOrganiser
-translateModels = ModelOrganiser()
 
-# generate file list
+pdfConverter = None # PdfConverter() (in the main process, while translateAll runs, with cfg.convertToPDF)
 files = SimpleNamespace(**{})
-update_fileList()
-print(str(len([v for v in files.inPath if G.extension(v) == ".docx"])) + " Word (.docx) files found in the input folder")
-if len(files.interPath) > 0: G.showErr(reason="intermediate folder is not empty.")
 
-# translate all word docs in the input folder
-def translateAll():
-	for i in range(len(files.inPath_docx)):
-		for j in range(len(cfg.outLanguage)):
-			print("Translating " + G.wrap(files.inPath_docx[i], "'") + " to " + G.wrap(LANGUAGES[cfg.outLanguage[j]], "'") + "..")
-			fileBasename_out = G.basename(files.inPath_docx[i]) + " -" + cfg.outLanguage[j]
-
-			if cfg.testingMode:
-				Translate.translateDoc(files.inPath_docx[i], cfg.inLanguage, cfg.outLanguage[j])
-			else:
-				try: Translate.translateDoc(files.inPath_docx[i], cfg.inLanguage, cfg.outLanguage[j])
-				except Exception as e:
-					print("Failed to translate " + G.wrap(files.inPath_docx[i], "'") + " to " + G.wrap(LANGUAGES[cfg.outLanguage[j]], "'") + ": " + str(e))
-					continue
+# convert a translated document to PDF (or move it to the output folder)
+# conversions are queued with pdfConverter, and finish in the background
+# the document's journal (see translateDoc_multi) is only deleted once this succeeds, so that a failed conversion or move can still be resumed
+def finishDoc(filename, targetLang):
+	fileBasename_out = G.basename(filename) + " -" + targetLang
+	path_journal = cfg.interPath + fileBasename_out + ".journal"
+
+	if cfg.convertToPDF:
+		def onDone(e):
+			if e is not None:
+				print("Failed to convert " + fileBasename_out + ".docx to PDF: " + str(e))
+				return
+			os.remove(cfg.interPath + fileBasename_out + ".docx")
+			if os.path.exists(path_journal): os.remove(path_journal)
+			print("Finished translating " + G.wrap(filename, "'") + " to " + G.wrap(LANGUAGES[targetLang], "'"))
+		pdfConverter.submit(cfg.interPath + fileBasename_out + ".docx", cfg.outPath, onDone)
+		return
+
+	with stats.time("move", 1): shutil.move(cfg.interPath + fileBasename_out + ".docx", cfg.outPath + fileBasename_out + ".docx")
+	if os.path.exists(path_journal): os.remove(path_journal)
+	print("Finished translating " + G.wrap(filename, "'") + " to " + G.wrap(LANGUAGES[targetLang], "'"))
+
+# Runs once in each worker process (when cfg.workers > 1). Each worker keeps its own models loaded for as long as it lives
+# optional parameter 'plan' is a list of cores for each worker (cpuAffinity.planCores), and 'slot' is a shared counter which gives each worker its place in the plan
+def _initWorker(cfgOptions, plan=None, slot=None):
+	vars(cfg).update(cfgOptions) # use the same config as the main process
+	cpus = None
+	if plan is not None:
+		with slot.get_lock():
+			cpus = plan[slot.value % len(plan)]
+			slot.value += 1
+	cpuAffinity.applyThreads(cfg.threadsPerWorker, cfg.interOpThreads, cpus)
+	Translate.textFilter = TextFilter(cfg.passthroughPatterns)
+	Translate.masker = Masker(cfg.maskPatterns)
+	Translate.decodeGuard = DecodeGuard(cfg.maxNewTokens, cfg.maxOutputRatio, cfg.stopEarly)
+	Translate.translateModels = ModelOrganiser(cfg.translationModels, cfg.modelMemoryBudget, pivotLanguage=cfg.pivotLanguage)
+	Translate.translationMemory = TranslationMemory(cfg.translationMemoryPath, cfg.translationMemorySize) if cfg.translationMemory else None
+	Translate.pivotCache = LruCache(cfg.pivotCacheSize)
+
+# Translates a document in a worker process. Returns the translation memory hits and misses, the models loaded during this job, the job's timing stats, text filter counts, masking counts, decoding guard counts and pivot cache counts, so that the main process can report them
+def _translateJob(filename, targetLangs):
+	hits, misses = (Translate.translationMemory.hits, Translate.translationMemory.misses) if Translate.translationMemory is not None else (0, 0)
+	loads = len(Translate.translateModels.loads)
+	stats.reset() # only this job's stats are sent back
+	Translate.textFilter.counts.clear()
+	Translate.masker.masked, Translate.masker.lost = 0, 0
+	guard = Translate.decodeGuard
+	guard.calls, guard.limited, guard.stops, guard.saved = 0, 0, 0, 0
+	Translate.pivotCache.hits, Translate.pivotCache.misses = 0, 0
+	Translate.translateDoc_multi(filename, cfg.inLanguage, targetLangs)
+	if Translate.translationMemory is not None: hits, misses = Translate.translationMemory.hits - hits, Translate.translationMemory.misses - misses
+	return (hits, misses, Translate.translateModels.loads[loads:], stats.snapshot(), dict(Translate.textFilter.counts), (Translate.masker.masked, Translate.masker.lost), (guard.calls, guard.limited, guard.stops, guard.saved), (Translate.pivotCache.hits, Translate.pivotCache.misses))
+
+# Returns the list of jobs (filename, list of target languages) needed to translate all word docs in the input folder
+# with cfg.multiTarget, each document is translated to every language at once (one job per document). otherwise, there is one job per document and language
+def listJobs():
+	jobs = []
+	languages = [v for v in cfg.outLanguage if Translate.translateModels.has(cfg.inLanguage, v)] # languages which have a model configured
+	for v in cfg.outLanguage:
+		if v not in languages: print("Failed to translate to " + G.wrap(LANGUAGES[v], "'") + ": no model with translation direction: " + cfg.inLanguage + "->" + v + " configured (directly, or through cfg.pivotLanguage).")
 
-			if cfg.convertToPDF:
-				try:
-					with suppress_stdout_stderr(): convert(cfg.interPath + fileBasename_out + ".docx", cfg.outPath)
-					os.remove(cfg.interPath + fileBasename_out + ".docx")
-				except Exception as e:
-						print("Failed to convert " + fileBasename_out + ".docx to PDF: " + str(e))
-						continue
-			else:
-				shutil.move(cfg.interPath + fileBasename_out + ".docx", cfg.outPath + fileBasename_out + ".docx")
-
-			print("Finished translating " + G.wrap(files.inPath_docx[i], "'") + " to " + G.wrap(LANGUAGES[cfg.outLanguage[j]], "'"))
+	for i in range(len(files.inPath_docx)):
+		outLanguage = languages
+		if cfg.resume: # skip languages which the document was already translated to by a previous run
+			outLanguage = [v for v in outLanguage if not os.path.exists(cfg.outPath + G.basename(files.inPath_docx[i]) + " -" + v + (".pdf" if cfg.convertToPDF else ".docx"))]
+			if len(outLanguage) < len(languages): print("Skipping " + G.wrap(files.inPath_docx[i], "'") + " to " + ", ".join([G.wrap(LANGUAGES[v], "'") for v in languages if v not in outLanguage]) + " (already translated)")
+			if len(outLanguage) == 0: continue
 
-translateAll()
+		for targetLangs in ([outLanguage] if cfg.multiTarget else [[v] for v in outLanguage]):
+			jobs.append((files.inPath_docx[i], targetLangs))
+	return jobs
 
-print("End of script:", G.wrap(os.path.basename(__file__), "'"))
-input("Press <ENTER> to exit")
+# translate all word docs in the input folder
+def translateAll(jobs=None):
+	global pdfConverter
+	if jobs is None: jobs = listJobs()
+
+	if cfg.convertToPDF:
+		try: pdfConverter = PdfConverter(cfg.pdfConverter, cfg.pdfWorkers, cfg.sofficePath)
+		except ValueError as e: G.showErr("Cannot convert to PDF", e)
+	try:
+		if cfg.workers > 1: translateAll_parallel(jobs)
+		elif cfg.concurrentDocs > 1: translateAll_concurrent(jobs)
+		else: translateAll_sequential(jobs)
+	finally:
+		if pdfConverter is not None:
+			print("Waiting for PDF conversions to finish..")
+			failed = pdfConverter.close()
+			pdfConverter = None
+			if len(failed) > 0:
+				print(Style.apply(str(len(failed)) + " PDF conversion(s) failed:", "RED"))
+				for path, e in failed: print("- " + os.path.basename(path) + ": " + str(e))
+
+# Translates the jobs one after the other, in this process
+def translateAll_sequential(jobs):
+	# with cfg.prefetch, the next document is loaded (and the next model is loaded) in the background while the current document is being translated
+	prefetched = {} # filename -> Future of Translate.loadDoc(filename)
+	if cfg.prefetch and (len(jobs) > 0):
+		from concurrent.futures import ThreadPoolExecutor
+		docPrefetcher = ThreadPoolExecutor(max_workers=1)
+		Translate.translateModels.prefetch(cfg.inLanguage, jobs[0][1][0])
+
+	for k, (filename, targetLangs) in enumerate(jobs):
+		print("Translating " + G.wrap(filename, "'") + " to " + ", ".join([G.wrap(LANGUAGES[v], "'") for v in targetLangs]) + "..")
+
+		future = prefetched.pop(filename, None)
+		if cfg.prefetch and (k+1 < len(jobs)):
+			if (jobs[k+1][0] != filename) and (jobs[k+1][0] not in prefetched): prefetched[jobs[k+1][0]] = docPrefetcher.submit(Translate.loadDoc, jobs[k+1][0])
+			Translate.translateModels.prefetch(cfg.inLanguage, jobs[k+1][1][0])
+
+		if cfg.testingMode:
+			Translate.translateDoc_multi(filename, cfg.inLanguage, targetLangs, future.result() if future is not None else None)
+		else:
+			try: Translate.translateDoc_multi(filename, cfg.inLanguage, targetLangs, future.result() if future is not None else None) # errors while prefetching the document are raised by future.result()
+			except Exception as e:
+				print("Failed to translate " + G.wrap(filename, "'") + " to " + ", ".join([G.wrap(LANGUAGES[v], "'") for v in targetLangs]) + ": " + str(e))
+				continue
+
+		for targetLang in targetLangs: finishDoc(filename, targetLang)
+
+# Same as translateAll_sequential, but cfg.concurrentDocs jobs are translated at the same time (in threads of this process)
+# batches from different documents are merged into shared model calls by a BatchScheduler, and the results are routed back to their documents
+def translateAll_concurrent(jobs):
+	from concurrent.futures import ThreadPoolExecutor, as_completed
+
+	print("Translating " + str(len(jobs)) + " job(s), " + str(cfg.concurrentDocs) + " at a time..")
+	failed = [] # list of (filename, targetLangs, error)
+
+	def translateJob(filename, targetLangs):
+		Translate.translateDoc_multi(filename, cfg.inLanguage, targetLangs)
+		for targetLang in targetLangs: finishDoc(filename, targetLang)
+
+	Translate.scheduler = BatchScheduler(Translate.decodeGuard.translate, cfg.batchSize, cfg.batchTokens, cfg.batchWait)
+	try:
+		with ThreadPoolExecutor(max_workers=cfg.concurrentDocs) as pool:
+			futures = {pool.submit(translateJob, filename, targetLangs): (filename, targetLangs) for filename, targetLangs in jobs}
+			for future in as_completed(futures):
+				filename, targetLangs = futures[future]
+				try: future.result()
+				except Exception as e:
+					if cfg.testingMode: raise
+					failed.append((filename, targetLangs, e))
+	finally:
+		Translate.scheduler.close()
+		print(Translate.scheduler.report())
+		Translate.scheduler = None # later translations call the model directly
+
+	if len(failed) > 0:
+		print(Style.apply(str(len(failed)) + " of " + str(len(jobs)) + " job(s) failed:", "RED"))
+		for filename, targetLangs, e in failed: print("- " + filename + " (" + ", ".join(targetLangs) + "): " + str(e))
+
+# Same as translateAll, but the jobs are spread over cfg.workers processes
+# translated documents are converted to PDF (or moved) by the main process as soon as each job finishes
+def translateAll_parallel(jobs):
+	from concurrent.futures import ProcessPoolExecutor, as_completed
+	import multiprocessing
+
+	print("Translating " + str(len(jobs)) + " job(s) with " + str(cfg.workers) + " worker processes..")
+	failed = [] # list of (filename, targetLangs, error)
+
+	plan = cpuAffinity.planCores(cfg.workers, cfg.threadsPerWorker, cfg.numaAware, *cfg.instance) if cfg.pinCores else None
+	if plan is not None:
+		for i, cpus in enumerate(plan): print("- worker " + str(i) + ": core(s) " + ",".join([str(v) for v in cpus]))
+	slot = multiprocessing.Value("i", 0)
+
+	with ProcessPoolExecutor(max_workers=cfg.workers, initializer=_initWorker, initargs=(vars(cfg), plan, slot)) as pool:
+		futures = {pool.submit(_translateJob, filename, targetLangs): (filename, targetLangs) for filename, targetLangs in jobs}
+
+		for future in as_completed(futures):
+			filename, targetLangs = futures[future]
+			try: hits, misses, loads, jobStats, filterCounts, (masked, lost), guardCounts, (pivotHits, pivotMisses) = future.result()
+			except Exception as e:
+				if cfg.testingMode: raise
+				print("Failed to translate " + G.wrap(filename, "'") + " to " + ", ".join([G.wrap(LANGUAGES[v], "'") for v in targetLangs]) + ": " + str(e))
+				failed.append((filename, targetLangs, e))
+				continue
+
+			Translate.translateModels.loads += loads
+			stats.merge(jobStats)
+			Translate.textFilter.counts.update(filterCounts)
+			Translate.masker.masked += masked
+			Translate.masker.lost += lost
+			guard = Translate.decodeGuard
+			guard.calls, guard.limited, guard.stops, guard.saved = [a + b for a, b in zip((guard.calls, guard.limited, guard.stops, guard.saved), guardCounts)]
+			Translate.pivotCache.hits += pivotHits
+			Translate.pivotCache.misses += pivotMisses
+			if Translate.translationMemory is not None:
+				Translate.translationMemory.hits += hits
+				Translate.translationMemory.misses += misses
+			for targetLang in targetLangs: finishDoc(filename, targetLang)
+
+	if len(failed) > 0:
+		print(Style.apply(str(len(failed)) + " of " + str(len(jobs)) + " job(s) failed:", "RED"))
+		for filename, targetLangs, e in failed: print("- " + filename + " (" + ", ".join(targetLangs) + "): " + str(e))
+
+# Loads a document the same way translateDoc_multi does, but only returns how much of it would be sent to the translator for each language in 'targetLangs' (for cfg.dryRun)
+# returns a SimpleNamespace(segments, resumed, texts, tokens). 'resumed', 'texts' and 'tokens' are totals over every language. segments found in the journal of an interrupted run arent counted in 'texts' and 'tokens'
+def estimateDoc(filename, targetLangs):
+	loaded = Translate.loadDoc(filename)
+	res = SimpleNamespace(segments=len(loaded.segments), resumed=0, texts=0, tokens=0)
+	for targetLang in targetLangs:
+		journal = Journal(cfg.interPath + G.basename(filename) + " -" + targetLang + ".journal", resume=True, readOnly=True) if cfg.resume else None
+		todo = dict.fromkeys([seg.text for i, seg in enumerate(loaded.segments) if seg.translate and ((journal is None) or (journal.lookup(i, seg.text) is None))]) # identical segments are only translated once per document
+		inputs = [v for text in todo for v in Translate.planInputs(Translate.planText(text, counted=False))] # text which the pre-filters let through to the translator
+		if journal is not None: res.resumed += journal.resumed
+		res.texts += len(inputs)
+		res.tokens += sum([countTokens(v) for v in inputs])
+	return res
+
+# Reports how much there is to translate in the jobs, without loading any translation model (cfg.dryRun)
+def dryRun(jobs):
+	total = SimpleNamespace(segments=0, resumed=0, texts=0, tokens=0)
+	directions = [] # (sourceLang, targetLang) of every model which would be loaded
+	for filename, targetLangs in jobs:
+		try: res = estimateDoc(filename, targetLangs)
+		except Exception as e:
+			if cfg.testingMode: raise
+			print("Failed to read " + G.wrap(filename, "'") + ": " + str(e))
+			continue
+		print(filename + " to " + ", ".join(targetLangs) + ": " + str(res.segments) + " segment(s)" + (" (" + str(res.resumed) + " already translated by a previous run)" if res.resumed > 0 else "")
+			+ ", " + str(res.texts) + " text(s) for the translator, ~" + str(res.tokens) + " token(s)")
+		for k, v in vars(res).items(): setattr(total, k, getattr(total, k) + v)
+
+		for targetLang in targetLangs:
+			pivotLang = Translate.translateModels.pivot(cfg.inLanguage, targetLang)
+			for hop in ([(cfg.inLanguage, targetLang)] if pivotLang is None else [(cfg.inLanguage, pivotLang), (pivotLang, targetLang)]):
+				if hop not in directions: directions.append(hop)
+
+	print("Dry run: " + str(len(jobs)) + " job(s), " + str(total.segments) + " segment(s) (" + str(total.resumed) + " already translated), "
+		+ str(total.texts) + " text(s) for the translator, ~" + str(total.tokens) + " token(s) (before the translation memory)")
+	if total.texts > 0: print("Model(s) needed: " + ", ".join([s + "->" + t + " (" + Translate.translateModels.path(s, t) + ", " + Translate.translateModels.backends[Translate.translateModels.path(s, t)] + ")" for s, t in directions]))
+
+# Updates cfg with the options given on the command line
+def parseArgs(argv=None):
+	parser = argparse.ArgumentParser(description="Translates the Word documents in cfg.inPath. Options given here override the config at the top of this file")
+	parser.add_argument("--workers", type=int, help="processes translating documents at the same time (cfg.workers)")
+	parser.add_argument("--threads", type=int, help="CPU threads each worker's models use per batch (cfg.threadsPerWorker)")
+	parser.add_argument("--inter-op-threads", type=int, help="batches each worker's models may run side by side (cfg.interOpThreads)")
+	parser.add_argument("--pin-cores", action="store_true", default=None, help="pin each worker to its own set of CPU cores (cfg.pinCores)")
+	parser.add_argument("--no-numa", action="store_true", help="when pinning, allow a worker to use cores from several NUMA nodes (cfg.numaAware)")
+	parser.add_argument("--instance", help="i/n: this is copy i (from 0) of n copies running side by side (cfg.instance)")
+	parser.add_argument("--concurrent-docs", type=int, help="documents translated at the same time by this process (cfg.concurrentDocs)")
+	parser.add_argument("--dry-run", action="store_true", help="only report how much there is to translate, without loading any model (cfg.dryRun)")
+	args = parser.parse_args(argv)
+
+	if args.workers is not None: cfg.workers = args.workers
+	if args.threads is not None: cfg.threadsPerWorker = args.threads
+	if args.inter_op_threads is not None: cfg.interOpThreads = args.inter_op_threads
+	if args.pin_cores is not None: cfg.pinCores = True
+	if args.no_numa: cfg.numaAware = False
+	if args.instance is not None:
+		try: cfg.instance = list(cpuAffinity.parseInstance(args.instance))
+		except ValueError as e: parser.error(str(e))
+	if args.concurrent_docs is not None: cfg.concurrentDocs = args.concurrent_docs
+	if args.dry_run: cfg.dryRun = True
+	return args
+
+# Translates the Word documents in cfg.inPath. Optional parameter 'argv' is a list of command line options (default: the ones this script was run with)
+# heavy libraries (torch, transformers, python-docx..) are only imported when theyre first needed, so runs with nothing to translate (or cfg.dryRun) finish quickly
+def main(argv=None):
+	parseArgs(argv)
+	dispConfig()
+	if cfg.workers <= 1: # otherwise, each worker process sets its own threads (see _initWorker)
+		cpuAffinity.applyThreads(cfg.threadsPerWorker, cfg.interOpThreads, cpuAffinity.planCores(1, cfg.threadsPerWorker, cfg.numaAware, *cfg.instance)[0] if cfg.pinCores else None)
+		print(cpuAffinity.report())
+
+	# Initialize ModelOrganiser
+	Translate.translateModels = ModelOrganiser(cfg.translationModels, cfg.modelMemoryBudget, pivotLanguage=cfg.pivotLanguage)
+
+	# generate file list
+	update_fileList()
+	print(str(len([v for v in files.inPath if G.extension(v) == ".docx"])) + " Word (.docx) files found in the input folder")
+	jobs = listJobs()
+	if cfg.dryRun: return dryRun(jobs)
+	if (len(files.interPath) > 0) and not cfg.resume: G.showErr(reason="intermediate folder is not empty.")
+
+	# Initialize translation memory
+	Translate.translationMemory = TranslationMemory(cfg.translationMemoryPath, cfg.translationMemorySize) if (cfg.translationMemory and (len(jobs) > 0)) else None
+
+	translateAll(jobs)
+
+	print(Translate.translateModels.report())
+	if Translate.translationMemory is not None:
+		print(Translate.translationMemory.report())
+		Translate.translationMemory.close()
+	print(Translate.textFilter.report())
+	if cfg.masking: print(Translate.masker.report())
+	print(Translate.decodeGuard.report())
+	if Translate.pivotCache.misses > 0: print("Pivot translations: " + str(Translate.pivotCache.hits) + " of " + str(Translate.pivotCache.hits + Translate.pivotCache.misses) + " intermediate translation(s) reused from the cache")
+
+	print(stats.table())
+	if cfg.statsReport != "":
+		stats.write(cfg.statsReport)
+		print("Timing report written to " + cfg.statsReport)
+
+	print("End of script:", G.wrap(os.path.basename(__file__), "'"))
+	input("Press <ENTER> to exit")
+
+if __name__ == "__main__":
+	main()
 
 # SOURCES ==========================================
 
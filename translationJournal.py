@@ -0,0 +1,63 @@
+'''
+translationJournal.py
+
+Function: Checkpoints for long translation jobs (used by translateSubtitles.py and translateWord.py)
+	Every translated segment (subtitle, paragraph, table cell..) of a (file, target language) pair is appended to a journal file in the intermediate folder
+	If the process dies, the next run reads the journal back and only translates the segments which are missing from it
+	The journal is deleted once the output file is complete
+
+Requirements:
+	Python
+'''
+
+# MODULES =========================================
+
+import os
+import json
+
+# DATA TYPES =======================================
+
+class Journal:
+	def __init__(self, path, resume=True, readOnly=False):
+		# readOnly: only read the segments of a previous run, without opening the journal for writing (ex: to estimate how much is left to translate)
+		self.path = path
+		self.entries = {} # segment index -> [source text, translation], of the segments recorded by a previous run
+		self.resumed = 0 # amount of segments which were taken from a previous run
+
+		line = "\n"
+		if resume and os.path.exists(path):
+			with open(path, mode="r", encoding="utf-8") as f:
+				for line in f:
+					try: entry = json.loads(line)
+					except ValueError: continue # the last line may be incomplete if the process was killed while writing it
+					self.entries[entry["i"]] = [entry["source"], entry["translation"]]
+
+		self.file = None
+		if readOnly: return
+		folder = os.path.dirname(path)
+		if folder != "": os.makedirs(folder, exist_ok=True)
+		self.file = open(path, mode=("a" if resume else "w"), encoding="utf-8")
+		if resume and not line.endswith("\n"): self.file.write("\n") # dont append to an incomplete last line
+
+	# Returns the translation of segment 'i' from a previous run, or None if it wasnt translated yet (or if the segment's text has changed since)
+	def lookup(self, i, source):
+		entry = self.entries.get(i)
+		if (entry is None) or (entry[0] != source): return None
+		self.resumed += 1
+		return entry[1]
+
+	# Appends a translated segment to the journal file (it isnt kept in 'entries', so that memory use doesnt grow with the file)
+	def record(self, i, source, translation):
+		self.file.write(json.dumps({"i": i, "source": source, "translation": translation}, ensure_ascii=False) + "\n")
+
+	# Makes sure everything recorded so far survives the process being killed
+	def flush(self):
+		self.file.flush()
+
+	# Deletes the journal (call once the output file is complete)
+	def finish(self):
+		self.file.close()
+		os.remove(self.path)
+
+	def close(self):
+		if self.file is not None: self.file.close()
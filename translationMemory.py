@@ -0,0 +1,165 @@
+'''
+translationMemory.py
+
+Function: On-disk translation memory shared by translateSubtitles.py and translateWord.py
+	Translations are stored in a local SQLite file, keyed by (model, source language, target language, normalized source text)
+		'model' names the model and the inference backend it is run with (see modelRegistry.ModelOrganiser.memoryKey), so that translations from one backend arent served for another
+	An in-process LRU sits in front of the SQLite file, so repeated lines ("Thank you.", headers, footers, table labels..) never reach the disk, or the model, twice
+	A TranslationMemory can be shared by several threads (translateServer.py handles each request in its own thread)
+	LruCache is a smaller, in-process only cache (used for the intermediate text of pivot translations)
+
+Requirements:
+	Python (sqlite3 is part of the standard library)
+'''
+
+# MODULES =========================================
+
+import sqlite3
+import time
+import threading
+from collections import OrderedDict
+
+# FUNCTIONS =======================================
+
+# Returns the form of a string that is used as the lookup key (leading/trailing whitespace removed, inner whitespace collapsed into single spaces)
+def normalize(text):
+	return " ".join(text.split())
+
+# DATA TYPES =======================================
+
+class TranslationMemory:
+	def __init__(self, path, maxEntries=200000, lruSize=10000):
+		self.path = path
+		self.maxEntries = maxEntries # max amount of translations kept in the SQLite file. When exceeded, the least recently used translations are evicted
+		self.lruSize = lruSize # max amount of translations kept in memory
+		self.lru = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evicted = 0
+		self.unchecked = 0 # amount of translations stored since the size cap was last checked
+
+		self.lock = threading.RLock() # guards the LRU and the connection
+		self.db = sqlite3.connect(path, timeout=30, check_same_thread=False) # other processes (translateWord.py workers) may be writing to the same file
+		self.db.execute("PRAGMA journal_mode=WAL") # a crash doesnt corrupt the file, and writes are cheap enough to commit after every batch
+		self.db.execute("PRAGMA synchronous=NORMAL")
+		self.db.execute("CREATE TABLE IF NOT EXISTS tm (model TEXT, sourceLang TEXT, targetLang TEXT, source TEXT, translation TEXT, lastUsed REAL, PRIMARY KEY (model, sourceLang, targetLang, source))")
+		self.db.execute("CREATE INDEX IF NOT EXISTS tm_lastUsed ON tm (lastUsed)")
+		self.db.commit()
+
+	def _remember(self, key, translation): # put a translation into the in-process LRU
+		self.lru[key] = translation
+		self.lru.move_to_end(key)
+		if len(self.lru) > self.lruSize: self.lru.popitem(last=False)
+
+	# Returns the stored translation of 'text', or None if it hasnt been translated before
+	def get(self, model, sourceLang, targetLang, text):
+		return self.getMany(model, sourceLang, targetLang, [text])[0]
+
+	# Same as get, for a list of strings. Returns a list containing a translation (or None) for each string
+	def getMany(self, model, sourceLang, targetLang, texts):
+		with self.lock: return self._getMany(model, sourceLang, targetLang, texts)
+
+	def _getMany(self, model, sourceLang, targetLang, texts):
+		res = [None] * len(texts)
+		found = [] # keys which were read from the SQLite file (their 'lastUsed' must be updated)
+		now = time.time()
+
+		for i, text in enumerate(texts):
+			key = (model, sourceLang, targetLang, normalize(text))
+			if key in self.lru:
+				self.lru.move_to_end(key)
+				res[i] = self.lru[key]
+			else:
+				row = self.db.execute("SELECT translation FROM tm WHERE model=? AND sourceLang=? AND targetLang=? AND source=?", key).fetchone()
+				if row is not None:
+					res[i] = row[0]
+					self._remember(key, row[0])
+					found.append((now,) + key)
+
+			if res[i] is None: self.misses += 1
+			else: self.hits += 1
+
+		if len(found) > 0:
+			self.db.executemany("UPDATE tm SET lastUsed=? WHERE model=? AND sourceLang=? AND targetLang=? AND source=?", found)
+			self.db.commit()
+		return res
+
+	def put(self, model, sourceLang, targetLang, text, translation):
+		self.putMany(model, sourceLang, targetLang, [text], [translation])
+
+	# Stores a list of translations (texts[i] was translated to translations[i])
+	def putMany(self, model, sourceLang, targetLang, texts, translations):
+		with self.lock: self._putMany(model, sourceLang, targetLang, texts, translations)
+
+	def _putMany(self, model, sourceLang, targetLang, texts, translations):
+		now = time.time()
+		rows = []
+		for text, translation in zip(texts, translations):
+			key = (model, sourceLang, targetLang, normalize(text))
+			self._remember(key, translation)
+			rows.append(key + (translation, now))
+
+		self.db.executemany("INSERT OR REPLACE INTO tm (model, sourceLang, targetLang, source, translation, lastUsed) VALUES (?, ?, ?, ?, ?, ?)", rows)
+		self.unchecked += len(rows)
+		if self.unchecked >= 1000: self._evict() # counting the rows isnt free, so the size cap is only checked every now and then
+		self.db.commit()
+
+	# Removes the least recently used translations from the SQLite file, if it holds more than maxEntries
+	def evict(self):
+		with self.lock: self._evict()
+
+	def _evict(self):
+		self.unchecked = 0
+		amt = self.db.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+		if amt <= self.maxEntries: return
+
+		# evict an extra 10% so that eviction doesnt run again on every single insert
+		amtEvict = amt - self.maxEntries + (self.maxEntries // 10)
+		self.db.execute("DELETE FROM tm WHERE rowid IN (SELECT rowid FROM tm ORDER BY lastUsed LIMIT ?)", (amtEvict,))
+		self.evicted += amtEvict
+
+	def __len__(self):
+		with self.lock: return self.db.execute("SELECT COUNT(*) FROM tm").fetchone()[0]
+
+	# Returns a line summarizing how useful the translation memory was during this run
+	def report(self):
+		total = self.hits + self.misses
+		return ("Translation memory: " + str(self.hits) + " hit(s), " + str(self.misses) + " miss(es)"
+			+ (" (" + str(round(self.hits / total * 100, 1)) + "% hit rate)" if total > 0 else "")
+			+ ", " + str(len(self)) + " stored translation(s)"
+			+ (", " + str(self.evicted) + " evicted" if self.evicted > 0 else ""))
+
+	def close(self):
+		with self.lock:
+			if self.unchecked > 0: self._evict()
+			self.db.commit()
+			self.db.close()
+
+class LruCache: # in-process cache, which forgets the least recently used entries first
+	def __init__(self, maxEntries=100000):
+		self.maxEntries = maxEntries
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	# Returns the stored value (or None) for each key in 'keys'
+	def getMany(self, keys):
+		res = []
+		with self.lock:
+			for key in keys:
+				if key in self.entries:
+					self.entries.move_to_end(key)
+					res.append(self.entries[key])
+					self.hits += 1
+				else:
+					res.append(None)
+					self.misses += 1
+		return res
+
+	def putMany(self, keys, values):
+		with self.lock:
+			for key, value in zip(keys, values):
+				self.entries[key] = value
+				self.entries.move_to_end(key)
+			while len(self.entries) > self.maxEntries: self.entries.popitem(last=False)
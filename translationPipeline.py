@@ -0,0 +1,140 @@
+'''
+translationPipeline.py
+
+Function: The text translation pipeline shared by translateSubtitles.py and translateWord.py (their Translate classes are built on Pipeline)
+	Strings go through the pre-filters (textFilter.py), the translation memory, masking, the pivot language (when there is no direct model), and are sent to the model in length-sorted batches, either directly (with the decoding guard, see decodeGuard.py) or through a BatchScheduler
+	Translations which look like garbage are replaced by the original text
+
+Requirements:
+	Python
+'''
+
+# MODULES =========================================
+
+from runStats import stats, countTokens # per-stage timing
+from decodeGuard import isRepetitive # catches translations which repeat themselves
+
+# DATA TYPES =======================================
+
+class Pipeline: # every method is a class method, which uses the class variables of the subclass (ex: translateSubtitles.Translate), so that a script can swap any part (ex: Translate.scheduler = ...)
+	options = None # the script's cfg. Uses: batchSize, masking, maxOutputRatio, verbosity
+	translateModels = None # ModelOrganiser() (models are loaded when first needed)
+	translationMemory = None # TranslationMemory() (or None if disabled)
+	pivotCache = None # LruCache() of the intermediate text of pivot translations: (sourceLang, pivotLang, text) -> translation
+	textFilter = None # TextFilter()
+	masker = None # Masker()
+	decodeGuard = None # DecodeGuard()
+	scheduler = None # BatchScheduler() which model calls go through, or None to call the model directly
+
+	@classmethod
+	def translateText(cls, text, sourceLang, targetLang):
+		return cls.translateTexts([text], sourceLang, targetLang)[0]
+
+	# Translates a list of strings, and returns a list of translated strings (in the same order)
+	# strings found in the translation memory are not translated again, and repeated strings are only translated once
+	# the rest are sorted by length and sent to the model in batches of options.batchSize, so that each batch contains strings of similar length (less padding)
+	# language pairs without a direct model are translated through the pivot language (see pivotTexts)
+	@classmethod
+	def translateTexts(cls, texts, sourceLang, targetLang):
+		pivotLang = cls.translateModels.pivot(sourceLang, targetLang)
+		if pivotLang is not None: return cls.translateTexts(cls.pivotTexts(texts, sourceLang, pivotLang), pivotLang, targetLang)
+
+		res = [None] * len(texts)
+		modelKey = cls.translateModels.memoryKey(sourceLang, targetLang)
+		memory = cls.translationMemory
+		if memory is not None:
+			with stats.time("memoryLookup", len(texts)): res = memory.getMany(modelKey, sourceLang, targetLang, texts)
+
+		unique = {} # text -> list of indexes in 'texts' which contain it
+		for i, text in enumerate(texts):
+			if res[i] is None: unique.setdefault(text, []).append(i)
+		order = sorted(unique.keys(), key=len, reverse=True)
+		if len(order) == 0: return res # only load the model if there is something to translate
+
+		with cls.translateModels.use(sourceLang, targetLang) as model: # the model isnt unloaded by another file / thread while these batches are translated
+			for b in range(0, len(order), cls.options.batchSize):
+				batch = order[b:b+cls.options.batchSize]
+				with stats.time("translate", len(batch)) as s:
+					if cls.scheduler is not None: translated = cls.scheduler.translate(model, batch, sourceLang, targetLang) # merged with batches from other files / requests
+					else: translated = cls.decodeGuard.translate(model, batch, sourceLang, targetLang)
+					s.tokensIn, s.tokensOut = sum([countTokens(v) for v in batch]), sum([countTokens(v) for v in translated])
+				for text, t in zip(batch, translated):
+					for i in unique[text]: res[i] = t
+				if memory is not None:
+					with stats.time("memoryStore", len(batch)): memory.putMany(modelKey, sourceLang, targetLang, batch, translated)
+
+		return res
+
+	# Translates a list of strings to the pivot language (the first hop of a pivot translation)
+	# the results are kept in pivotCache, so that translating the same text to several languages only does the first hop once
+	@classmethod
+	def pivotTexts(cls, texts, sourceLang, pivotLang):
+		res = cls.pivotCache.getMany([(sourceLang, pivotLang, v) for v in texts])
+		todo = list(dict.fromkeys([v for v, r in zip(texts, res) if r is None]))
+		if len(todo) == 0: return res
+
+		translated = dict(zip(todo, cls.translateTexts(todo, sourceLang, pivotLang)))
+		cls.pivotCache.putMany([(sourceLang, pivotLang, v) for v in todo], [translated[v] for v in todo])
+		return [(r if r is not None else translated[v]) for v, r in zip(texts, res)]
+
+	# Same as translateTexts, but with options.masking, tags, URLs, numbers.. are swapped for placeholders before translation, and put back afterwards (see textFilter.py)
+	@classmethod
+	def translateTexts_masked(cls, texts, sourceLang, targetLang):
+		if not cls.options.masking: return cls.translateTexts(texts, sourceLang, targetLang)
+		return cls.masker.translate(texts, lambda v: cls.translateTexts(v, sourceLang, targetLang))
+
+	# Decides what needs to be done with a string before it can be sent to the translator (see textFilter.py). Returns a "plan", which is one of:
+		# ["done", result, text]: the string doesnt need to be translated. 'result' is used as-is
+		# ["translate", text]: the string is sent to the translator
+		# ["wrap", prefix, innerPlan, suffix, text]: only part of the string is translated (according to 'innerPlan'), and the prefix / suffix are re-attached afterwards
+	@classmethod
+	def planText(cls, text, counted=True):
+		return cls.textFilter.plan(text, counted)
+
+	# Returns a list of the strings within a plan that need to be sent to the translator
+	@classmethod
+	def planInputs(cls, plan):
+		if plan[0] == "translate": return [plan[1]]
+		elif plan[0] == "wrap": return cls.planInputs(plan[2])
+		else: return []
+
+	# Puts a plan back together using an iterator of translated strings (in the order given by planInputs)
+	@classmethod
+	def assemblePlan(cls, plan, translated):
+		if plan[0] == "done":
+			res, text = plan[1], plan[2]
+		elif plan[0] == "translate":
+			res, text = next(translated), plan[1]
+			if cls.options.verbosity >= 5: print("Clear")
+		else:
+			res, text = plan[1] + cls.assemblePlan(plan[2], translated) + plan[3], plan[4]
+
+		if cls.isGarbage(res, text):
+			if cls.options.verbosity >= 4: print("Translation looks like some garbage. Using original un-translated text..")
+			return text # if the translator bugs and returns a bunch of garbage, return the original untranslated text
+		else: return res
+
+	@classmethod
+	def isGarbage(cls, res, text):
+		return (
+			len(res) > cls.options.maxOutputRatio*len(text)
+			or (".........." in res)
+			or ("----------" in res)
+			or isRepetitive(res, text)
+		)
+
+	@classmethod
+	def translateText_robust(cls, text, sourceLang, targetLang):
+		if cls.options.verbosity >= 4: print("Translating text: \"" + text + "\"")
+		plan = cls.planText(text)
+		return cls.assemblePlan(plan, iter(cls.translateTexts_masked(cls.planInputs(plan), sourceLang, targetLang)))
+
+	# Same as translateText_robust, but for a list of strings. All the strings which pass the pre-filters are translated together in batches
+	@classmethod
+	def translateTexts_robust(cls, texts, sourceLang, targetLang):
+		plans = [cls.planText(v) for v in texts]
+		inputs = [cls.planInputs(v) for v in plans]
+		if cls.options.verbosity >= 4: print("Translating " + str(sum([len(v) for v in inputs])) + " of " + str(len(texts)) + " text(s) in batches of " + str(cls.options.batchSize))
+
+		translated = iter(cls.translateTexts_masked([v for i in inputs for v in i], sourceLang, targetLang))
+		return [cls.assemblePlan(plan, translated) for plan in plans]
@@ -0,0 +1,134 @@
+'''
+wordXml.py
+
+Function: Reads and writes the text of Word (.docx) files directly from their XML (used by translateWord.py, with cfg.docEngine = "xml")
+	python-docx builds a proxy object for every table, cell, paragraph and run each time they are accessed, which gets slow on large documents (especially large tables)
+	Here, each part of the document which holds text (the body, headers, footers, footnotes and endnotes) is parsed in a single pass, and paragraphs are collected as soon as the parser reaches them
+	This covers every paragraph, wherever it is: nested tables, text boxes, content controls.. Headers and footers shared by several sections are a single part, so they are only collected once
+	Fields (ex: page numbers) are left as-is, and hyperlink text is translated separately from the text around it, so that both keep working
+	When saving, only those parts are re-written. Every other part of the .docx (styles, pictures..) is copied over as-is
+
+Requirements:
+	Python
+	Install the lxml library: terminal > "pip install lxml" (installed along with python-docx)
+'''
+
+# MODULES =========================================
+
+import re
+import zipfile
+from collections import OrderedDict
+from types import SimpleNamespace
+from lxml import etree
+
+# DATA ============================================
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}" # WordprocessingML namespace
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+DOCUMENT_PART = "word/document.xml"
+TEXT_PARTS = re.compile(r"^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$") # parts of a .docx which contain translatable paragraphs
+
+# DATA TYPES =======================================
+
+# A run (w:r element). Has the same 'text' property as a python-docx run, so that segments from either engine are handled the same way
+class Run:
+	def __init__(self, element):
+		self.element = element
+
+	@property
+	def text(self):
+		text = ""
+		for child in self.element:
+			if child.tag == W + "t": text += child.text or ""
+			elif child.tag == W + "tab": text += "\t"
+			elif (child.tag == W + "br" and child.get(W + "type") in [None, "textWrapping"]) or (child.tag == W + "cr"): text += "\n"
+		return text
+
+	@text.setter
+	def text(self, text):
+		# only the text is replaced. Other content of the run (pictures, page breaks..) is kept
+		for child in list(self.element):
+			if (child.tag in [W + "t", W + "tab", W + "cr"]) or (child.tag == W + "br" and child.get(W + "type") in [None, "textWrapping"]):
+				self.element.remove(child)
+
+		pieces = text.replace("\r", "").split("\n")
+		for i, line in enumerate(pieces):
+			for j, piece in enumerate(line.split("\t")):
+				if j > 0: etree.SubElement(self.element, W + "tab")
+				if piece != "":
+					t = etree.SubElement(self.element, W + "t")
+					t.text = piece
+					if piece != piece.strip(): t.set(XML_SPACE, "preserve") # keep leading / trailing spaces
+			if i < len(pieces) - 1: etree.SubElement(self.element, W + "br")
+
+	# whether or not the run is superscript or subscript (only the run's own formatting is checked, like python-docx's font.superscript)
+	@property
+	def raised(self):
+		vertAlign = self.element.find(W + "rPr/" + W + "vertAlign")
+		return (vertAlign is not None) and (vertAlign.get(W + "val") in ["superscript", "subscript"])
+
+class Document:
+	def __init__(self, path):
+		self.path = path
+		self.parts = OrderedDict() # part name -> root element, for every part which contains text (the body first)
+		self.paragraphs = [] # w:p element of every paragraph
+		with zipfile.ZipFile(path) as z:
+			names = [v for v in z.namelist() if TEXT_PARTS.match(v)]
+			for name in sorted(names, key=lambda v: v != DOCUMENT_PART):
+				with z.open(name) as f:
+					parser = etree.iterparse(f, events=("end",), tag=W + "p", huge_tree=True)
+					for event, p in parser:
+						self.paragraphs.append(p)
+					self.parts[name] = parser.root
+
+	# Writes the document to 'path'. Every part which doesnt contain text is copied from the original file unchanged
+	def save(self, path):
+		with zipfile.ZipFile(self.path) as zin, zipfile.ZipFile(path, mode="w", compression=zipfile.ZIP_DEFLATED) as zout:
+			for item in zin.infolist():
+				if item.filename in self.parts: zout.writestr(item, etree.tostring(self.parts[item.filename], xml_declaration=True, encoding="UTF-8", standalone=True))
+				else: zout.writestr(item, zin.read(item.filename))
+
+# FUNCTIONS =======================================
+
+# Returns the runs of a paragraph, split into groups which are translated separately. Includes runs inside hyperlinks, tracked insertions and content controls, but not the runs of paragraphs nested inside it (text boxes)
+	# the runs of a field (ex: a PAGE number, from its 'begin' w:fldChar to its 'end' w:fldChar, or inside a w:fldSimple) are left out, and split the text around them, so that the field keeps working
+	# the runs inside a hyperlink are a group of their own, so that their translation stays inside the hyperlink
+def paragraphRuns(p):
+	groups = []
+	key = None # what the last group is made of: "text", or the w:hyperlink element
+	depth = 0 # amount of fields the current run is in
+	for r in p.iter(W + "r"):
+		link, simpleField = None, False
+		parent = r.getparent()
+		while parent.tag != W + "p":
+			if parent.tag == W + "hyperlink": link = parent if link is None else link
+			elif parent.tag == W + "fldSimple": simpleField = True
+			parent = parent.getparent()
+		if parent is not p: continue
+
+		fldChars = [v.get(W + "fldCharType") for v in r.iter(W + "fldChar")]
+		inField = simpleField or (depth > 0) or (len(fldChars) > 0)
+		for v in fldChars: depth += {"begin": 1, "end": -1}.get(v, 0)
+		if inField:
+			key = None
+			continue
+
+		k = link if link is not None else "text"
+		if (key is None) or (k is not key): groups.append([])
+		key = k
+		groups[-1].append(Run(r))
+	return groups
+
+# Same as translateWord.py's Translate.collectSegments, for a Document: every group of runs in a paragraph (see paragraphRuns) is translated as a whole (the text is put into the first run which contains an alphabetical character)
+# the whitespace around a group (ex: "See " before a hyperlink) is kept out of 'text' (the model drops it), and put back by applySegments
+def collectSegments(doc):
+	segments = []
+	for p in doc.paragraphs:
+		for runs in paragraphRuns(p):
+			texts = [r.text for r in runs]
+			for i in range(len(runs)):
+				if any([v.isalpha() for v in texts[i]]):
+					text = "".join(texts)
+					segments.append(SimpleNamespace(runs=runs, target=i, text=text.strip(), lead=text[:len(text)-len(text.lstrip())], trail=text[len(text.rstrip()):], translate=not runs[i].raised))
+					break
+	return segments